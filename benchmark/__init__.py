@@ -0,0 +1,331 @@
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Optional
+
+import psycopg2
+
+from data_generator import DataGenerator
+from options import Options
+from output import StreamOutput
+from schema_generator import SchemaGenerator
+
+PAYLOAD_TYPES = ['text', 'integer', 'jsonb', 'timestamptz', 'numeric(12,2)', 'bytea']
+PAYLOAD_EXPRESSIONS = {
+    'text': 'md5(g::text) || repeat(\'x\', g % 64)',
+    'integer': 'g * 7',
+    'jsonb': 'jsonb_build_object(\'id\', g, \'name\', md5(g::text))',
+    'timestamptz': 'timestamptz \'2020-01-01\' + g * interval \'1 minute\'',
+    'numeric(12,2)': 'g * 1.25',
+    'bytea': 'decode(md5(g::text), \'hex\')',
+}
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    queries = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.queries += 1
+
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        CountingCursor.queries += 1
+
+        return super().copy_expert(sql, file, size)
+
+
+class CountingSink(io.TextIOBase):
+    def __init__(self):
+        self.bytes = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        self.bytes += len(data.encode('utf-8'))
+
+        return len(data)
+
+
+class SyntheticSchema:
+    def __init__(self, tables: int, fanout: int, depth: int, width: int, rows: int,
+                 seed: int = 1):
+        self.tables = tables
+        self.fanout = fanout
+        self.depth = depth
+        self.width = width
+        self.rows = rows
+        self.seed = seed
+
+    def describe(self) -> Dict[str, int]:
+        return {'tables': self.tables, 'fanout': self.fanout, 'depth': self.depth,
+                'width': self.width, 'rows': self.rows}
+
+    def get_levels(self) -> List[List[int]]:
+        depth = max(1, min(self.depth, self.tables))
+        levels = [[] for _ in range(depth)]
+        for table in range(self.tables):
+            levels[table * depth // self.tables].append(table)
+
+        return levels
+
+    def generate(self) -> List[str]:
+        rand = random.Random(self.seed)
+        statements = []
+        parents_of = {}
+        previous = []
+
+        for level in self.get_levels():
+            for table in level:
+                parents = rand.sample(previous, min(self.fanout, len(previous)))
+                parents_of[table] = parents
+
+                columns = ['id bigint PRIMARY KEY']
+                columns += [f'parent_{parent} bigint NOT NULL REFERENCES bench_{parent}(id)'
+                            for parent in parents]
+                columns += [f'col_{column} {PAYLOAD_TYPES[column % len(PAYLOAD_TYPES)]}'
+                            for column in range(self.width)]
+                statements.append(f'CREATE TABLE bench_{table} ({", ".join(columns)})')
+
+                values = ['g']
+                values += [f'1 + (g * {parent + 7}) % {self.rows}' for parent in parents]
+                values += [PAYLOAD_EXPRESSIONS[PAYLOAD_TYPES[column % len(PAYLOAD_TYPES)]]
+                           for column in range(self.width)]
+                statements.append(f'INSERT INTO bench_{table} SELECT {", ".join(values)} '
+                                  f'FROM generate_series(1, {self.rows}) g')
+
+            previous += level
+
+        statements.append('ANALYZE')
+
+        return statements
+
+
+class LocalCluster:
+    def __init__(self, bin_dir: str = None):
+        self.bin_dir = bin_dir
+        self.directory = None
+
+    def get_binary(self, name: str) -> str:
+        binary = os.path.join(self.bin_dir, name) if self.bin_dir else shutil.which(name)
+        if not binary:
+            raise RuntimeError(f'{name} not found, pass --pg-bin or --dsn')
+
+        return binary
+
+    def start(self) -> str:
+        self.directory = tempfile.mkdtemp(prefix='pg-slicer-bench-')
+        data_dir = os.path.join(self.directory, 'data')
+
+        subprocess.run([self.get_binary('initdb'), '-D', data_dir, '-U', 'postgres', '-A', 'trust',
+                        '--no-sync'], check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self.get_binary('pg_ctl'), '-D', data_dir, '-w', '-l',
+                        os.path.join(self.directory, 'server.log'), '-o',
+                        f'-k {self.directory} -c listen_addresses=\'\' -c fsync=off', 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        return f'host={self.directory} user=postgres dbname=postgres'
+
+    def stop(self) -> None:
+        if not self.directory:
+            return
+
+        subprocess.run([self.get_binary('pg_ctl'), '-D', os.path.join(self.directory, 'data'),
+                        '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def peak_rss_kb() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def timed(timings: Dict[str, Dict[str, float]], name: str, func: Callable) -> Callable:
+    timings[name] = {'calls': 0, 'seconds': 0.0}
+
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[name]['calls'] += 1
+            timings[name]['seconds'] += time.perf_counter() - started
+
+    return wrapper
+
+
+def run_scenario(dsn: str, variant: Dict[str, Any]) -> Dict[str, Any]:
+    options = Options()
+    options.limit = variant['limit']
+    options.bulk_introspection = variant['bulk_introspection']
+    options.extraction = variant['extraction']
+    options.apply_defaults()
+
+    connection = psycopg2.connect(dsn, cursor_factory=CountingCursor)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    result = {}
+
+    schema_generator = SchemaGenerator(cursor, options)
+    CountingCursor.queries = 0
+    started = time.perf_counter()
+    schema = schema_generator.generate_schema()
+    result['generate_schema'] = {
+        'seconds': time.perf_counter() - started,
+        'queries': CountingCursor.queries,
+        'tables': len(schema_generator.tables),
+        'bytes': len(schema.encode('utf-8')),
+    }
+
+    sink = CountingSink()
+    data_generator = DataGenerator(cursor, schema_generator, options, StreamOutput(sink))
+    timings = {}
+    data_generator.select_from = timed(timings, 'select_from', data_generator.select_from)
+    data_generator.do_select_with_condition = timed(timings, 'do_select_with_condition',
+                                                    data_generator.do_select_with_condition)
+
+    CountingCursor.queries = 0
+    started = time.perf_counter()
+    data_generator.generate_data()
+    seconds = time.perf_counter() - started
+    rows = sum(data_generator.row_counts.values())
+
+    result['generate_data'] = {
+        'seconds': seconds,
+        'queries': CountingCursor.queries,
+        'rows': rows,
+        'rows_per_second': rows / seconds if seconds else None,
+        'bytes': sink.bytes,
+    }
+    result.update(timings)
+
+    connection.close()
+    result['peak_rss_kb'] = peak_rss_kb()
+
+    return result
+
+
+class Benchmark:
+    results: List[Dict[str, Any]]
+
+    def __init__(self, dsn: str, schemas: List[SyntheticSchema], variants: List[Dict[str, Any]]):
+        self.dsn = dsn
+        self.schemas = schemas
+        self.variants = variants
+        self.results = []
+
+    def create_database(self, name: str, schema: SyntheticSchema) -> str:
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS {name}')
+            cursor.execute(f'CREATE DATABASE {name}')
+        connection.close()
+
+        dsn = f'{self.dsn} dbname={name}'
+        connection = psycopg2.connect(dsn)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            for statement in schema.generate():
+                cursor.execute(statement)
+        connection.close()
+
+        return dsn
+
+    def drop_database(self, name: str) -> None:
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP DATABASE IF EXISTS {name}')
+        connection.close()
+
+    def run(self, log: Optional[Callable[[str], None]] = None) -> List[Dict[str, Any]]:
+        for index, schema in enumerate(self.schemas):
+            name = f'pg_slicer_bench_{os.getpid()}_{index}'
+            started = time.perf_counter()
+            dsn = self.create_database(name, schema)
+            setup_seconds = time.perf_counter() - started
+
+            try:
+                for variant in self.variants:
+                    with ProcessPoolExecutor(max_workers=1,
+                                             mp_context=get_context('spawn')) as executor:
+                        metrics = executor.submit(run_scenario, dsn, variant).result()
+
+                    result = {'schema': schema.describe(), 'variant': variant,
+                              'setup_seconds': setup_seconds, 'metrics': metrics}
+                    self.results.append(result)
+
+                    if log:
+                        log(self.format_result(result))
+            finally:
+                self.drop_database(name)
+
+        return self.results
+
+    @staticmethod
+    def format_result(result: Dict[str, Any]) -> str:
+        schema = ' '.join([f'{key}={value}' for key, value in result['schema'].items()])
+        variant = ' '.join([f'{key}={value}' for key, value in result['variant'].items()])
+        introspection = result['metrics']['generate_schema']
+        data = result['metrics']['generate_data']
+
+        return f'{schema} {variant}: ' \
+               f'introspection {introspection["seconds"]:.3f}s/{introspection["queries"]}q, ' \
+               f'data {data["seconds"]:.3f}s/{data["queries"]}q ' \
+               f'{data["rows"]} rows {data["bytes"]} bytes, ' \
+               f'process peak rss {result["metrics"]["peak_rss_kb"]} KB'
+
+    def get_server_version(self) -> str:
+        connection = psycopg2.connect(self.dsn)
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW server_version')
+            version = cursor.fetchone()[0]
+        connection.close()
+
+        return version
+
+    def save(self, path: str) -> None:
+        report = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'server_version': self.get_server_version(),
+            'results': self.results,
+        }
+
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+
+    @staticmethod
+    def compare(baseline_path: str, results: List[Dict[str, Any]]) -> List[str]:
+        with open(baseline_path, 'r') as baseline_file:
+            baseline = {json.dumps([result['schema'], result['variant']], sort_keys=True): result
+                        for result in json.load(baseline_file)['results']}
+
+        lines = []
+        for result in results:
+            old = baseline.get(json.dumps([result['schema'], result['variant']], sort_keys=True))
+            if not old:
+                continue
+
+            for phase in ['generate_schema', 'generate_data']:
+                old_seconds = old['metrics'][phase]['seconds']
+                new_seconds = result['metrics'][phase]['seconds']
+                ratio = new_seconds / old_seconds if old_seconds else 0
+                lines.append(f'{Benchmark.format_result(result).split(":")[0]} {phase}: '
+                             f'{old_seconds:.3f}s -> {new_seconds:.3f}s ({ratio:.2f}x)')
+
+        return lines
@@ -0,0 +1,110 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from key_store import KeySet
+
+
+class TableCheckpoint:
+    def __init__(self,
+                 name: str,
+                 layer: int,
+                 rows: int,
+                 watermark_column: Optional[str],
+                 watermark: Optional[str]):
+        self.name = name
+        self.layer = layer
+        self.rows = rows
+        self.watermark_column = watermark_column
+        self.watermark = watermark
+
+
+class Checkpoint:
+    VERSION = 1
+    FILE = 'checkpoint.sqlite'
+    RUNNING = 'running'
+    COMPLETE = 'complete'
+
+    tables: Dict[str, TableCheckpoint]
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path.joinpath(self.FILE)),
+                                          check_same_thread=False, isolation_level=None)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (name PRIMARY KEY, value)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tables (name PRIMARY KEY, layer, '
+                                'rows, watermark_column, watermark)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS keys (table_name, position, value, '
+                                'PRIMARY KEY (table_name, position, value)) WITHOUT ROWID')
+        self.tables = {row[0]: TableCheckpoint(*row) for row in self.connection.execute(
+            'SELECT name, layer, rows, watermark_column, watermark FROM tables')}
+
+    def get_meta(self, name: str) -> Optional[Any]:
+        row = self.connection.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+
+        return row[0] if row else None
+
+    def set_meta(self, name: str, value: Any) -> None:
+        self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (name, value))
+
+    def get_state(self, database: str) -> Optional[str]:
+        if self.get_meta('version') != self.VERSION or self.get_meta('database') != database:
+            return None
+
+        return self.get_meta('state')
+
+    def start(self, database: str) -> None:
+        with self.lock:
+            self.connection.execute('BEGIN')
+            for table in ['meta', 'tables', 'keys']:
+                self.connection.execute(f'DELETE FROM {table}')
+
+            self.set_meta('version', self.VERSION)
+            self.set_meta('database', database)
+            self.set_meta('state', self.RUNNING)
+            self.connection.execute('COMMIT')
+            self.tables = {}
+
+    def begin(self) -> None:
+        with self.lock:
+            self.connection.execute('BEGIN')
+
+    def finish(self) -> None:
+        with self.lock:
+            self.set_meta('state', self.COMPLETE)
+            if self.connection.in_transaction:
+                self.connection.execute('COMMIT')
+
+    def save_table(self, table: TableCheckpoint, key_sets: List[KeySet]) -> None:
+        with self.lock:
+            nested = self.connection.in_transaction
+            if not nested:
+                self.connection.execute('BEGIN')
+
+            self.connection.execute('INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, ?)',
+                                    (table.name, table.layer, table.rows,
+                                     table.watermark_column, table.watermark))
+
+            for key_set in key_sets:
+                self.connection.executemany('INSERT OR IGNORE INTO keys VALUES (?, ?, ?)',
+                                            ((table.name, key_set.position, value)
+                                             for value in key_set))
+
+            if not nested:
+                self.connection.execute('COMMIT')
+
+            self.tables[table.name] = table
+
+    def get_keys(self, table_name: str) -> Iterator[Tuple[int, Any]]:
+        return ((row[0], row[1]) for row in self.connection.execute(
+            'SELECT position, value FROM keys WHERE table_name = ?', (table_name,)))
+
+    def close(self) -> None:
+        with self.lock:
+            if self.connection.in_transaction:
+                self.connection.execute('ROLLBACK')
+
+            self.connection.close()
@@ -1,84 +1,797 @@
+import io
+import itertools
 import json
-from typing import Optional, List, Dict, Any
+import re
+import struct
+import sys
+import time
+import uuid
+from typing import IO, Optional, Dict, Any, Callable, List, Set, TextIO, Tuple, Union
 
 from psycopg2.extensions import cursor as _cursor
 
+from checkpoint import Checkpoint, TableCheckpoint
+from dependency_graph import DependencyGraph
+from key_store import INT_TYPES, KeySet, KeyStore
+from masking import Masking, PythonMask
 from options import Options
+from output import BINARY_HEADER, BINARY_TRAILER, MERGE_TABLE, StreamOutput, DirectoryOutput, \
+    TargetOutput, get_merge_statements
+from sampling import Sampling
 from schema_generator import SchemaGenerator, Table, Relation, Column
+from stats import Stats
+from worker_pool import WorkerPool
+
+COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t', 'v': '\v'}
+COPY_ESCAPE_RE = re.compile(r'\\(x[0-9a-fA-F]{1,2}|[0-7]{1,3}|.)')
+BINARY_TEXT_TYPE_RE = re.compile(r'^(text|character varying|character|citext|name)(\(\d+\))?$')
+BINARY_DECODERS = {
+    'smallint': lambda value: struct.unpack('!h', value)[0],
+    'integer': lambda value: struct.unpack('!i', value)[0],
+    'bigint': lambda value: struct.unpack('!q', value)[0],
+    'boolean': lambda value: 't' if value[0] else 'f',
+    'uuid': lambda value: str(uuid.UUID(bytes=bytes(value))),
+}
+
+
+def decode_copy_value(value: str) -> Optional[str]:
+    if value == '\\N':
+        return None
+
+    if '\\' not in value:
+        return value
+
+    def unescape(match) -> str:
+        sequence = match.group(1)
+        if sequence[0] == 'x' and len(sequence) > 1:
+            return chr(int(sequence[1:], 16))
+        if sequence[0] in '01234567':
+            return chr(int(sequence, 8))
+
+        return COPY_ESCAPES.get(sequence, sequence)
+
+    return COPY_ESCAPE_RE.sub(unescape, value)
+
+
+def encode_copy_value(value: Any) -> str:
+    if value is None:
+        return '\\N'
+
+    if type(value) is bool:
+        return 't' if value else 'f'
+
+    if type(value) is dict:
+        value = json.dumps(value)
+    elif type(value) is not str:
+        value = str(value)
+
+    return value \
+        .replace('\\', '\\\\') \
+        .replace('\r\n', '\n') \
+        .replace('\n', '\\r\\n') \
+        .replace('\r', '\\r') \
+        .replace('\t', '\\t')
+
+
+def get_binary_decoder(column_type: str) -> Optional[Callable[[bytes], Any]]:
+    if BINARY_TEXT_TYPE_RE.match(column_type):
+        return lambda value: bytes(value).decode('utf-8')
+
+    return BINARY_DECODERS.get(column_type)
+
+
+def get_identity_key(identity: tuple) -> str:
+    return '\0'.join([value.hex() if isinstance(value, bytes) else value for value in identity])
+
+
+def format_key(value: Any) -> str:
+    if type(value) is bool:
+        return 't' if value else 'f'
+
+    if type(value) is dict:
+        return json.dumps(value)
+
+    return str(value)
+
+
+class Projection:
+    def __init__(self,
+                 columns: str,
+                 key_columns: Dict[int, int],
+                 identity: List[int],
+                 trailing: int,
+                 masks: Dict[int, PythonMask],
+                 names: List[str] = None):
+        self.columns = columns
+        self.names = names or []
+        self.key_columns = key_columns
+        self.identity = identity
+        self.trailing = trailing
+        self.masks = masks
+
+
+class RowWriter:
+    BUDGET_CHECK_INTERVAL = 4096
+
+    def __init__(self,
+                 table: Table,
+                 key_columns: Dict[int, int],
+                 keys: Dict[int, KeySet],
+                 key_store: KeyStore,
+                 output: IO,
+                 timed: bool = False,
+                 seen: Union[Dict[tuple, object], KeySet] = None,
+                 identity: List[int] = None,
+                 trailing: int = 0,
+                 seen_store: KeyStore = None):
+        self.table = table
+        self.key_columns = key_columns
+        self.keys = keys
+        self.key_store = key_store
+        self.output = output
+        self.timed = timed
+        self.seen = seen
+        self.identity = identity or []
+        self.trailing = trailing
+        self.seen_store = seen_store
+        self.rows = 0
+        self.fetched = 0
+        self.encode_seconds = 0.0
+        self.write_seconds = 0.0
+        self.bytes = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def is_seen(self, identity: tuple) -> bool:
+        if isinstance(self.seen, KeySet):
+            return not self.seen.add(get_identity_key(identity))
+
+        marker = object()
+
+        return self.seen.setdefault(identity, marker) is not marker
+
+    def write_data(self, data: Union[str, bytes], started: float) -> None:
+        if not self.timed:
+            self.output.write(data)
+
+            return
+
+        encoded = time.perf_counter()
+        self.output.write(data)
+        self.encode_seconds += encoded - started
+        self.write_seconds += time.perf_counter() - encoded
+        self.bytes += len(data) if isinstance(data, bytes) else len(data.encode('utf-8'))
+
+    def count_rows(self, rows: int) -> None:
+        if (self.rows + rows) // self.BUDGET_CHECK_INTERVAL \
+                != self.rows // self.BUDGET_CHECK_INTERVAL:
+            if self.keys:
+                self.key_store.enforce_budget(list(self.keys.values()))
+
+            if self.seen_store:
+                self.seen_store.enforce_budget()
+
+        self.rows += rows
+
+    def close(self) -> None:
+        for key_set in self.keys.values():
+            key_set.sealed = True
+
+        if self.keys:
+            self.key_store.enforce_budget()
+
+        if self.seen_store:
+            self.seen_store.enforce_budget()
+
+        super().close()
+
+
+class CopyWriter(RowWriter, io.TextIOBase):
+    def __init__(self,
+                 table: Table,
+                 key_columns: Dict[int, int],
+                 keys: Dict[int, KeySet],
+                 key_store: KeyStore,
+                 output: TextIO,
+                 framed: bool = True,
+                 timed: bool = False,
+                 seen: Union[Dict[tuple, object], KeySet] = None,
+                 identity: List[int] = None,
+                 trailing: int = 0,
+                 merge: Tuple[str, str] = None,
+                 masks: Dict[int, PythonMask] = None,
+                 seen_store: KeyStore = None):
+        super().__init__(table, key_columns, keys, key_store, output, timed, seen, identity,
+                         trailing, seen_store)
+        self.framed = framed
+        self.merge = merge
+        self.masks = masks or {}
+        self.tail = ''
+
+    def write_header(self) -> None:
+        if self.framed and self.merge:
+            self.output.write(f'{self.merge[0]};\nCOPY {MERGE_TABLE} FROM stdin;\n')
+        elif self.framed:
+            self.output.write(f'COPY {self.table.name} FROM stdin;\n')
+
+    def write(self, data: str) -> int:
+        lines = (self.tail + data).split('\n')
+        self.tail = lines.pop()
+        self.fetched += len(lines)
+
+        if not lines:
+            return len(data)
+
+        started = time.perf_counter() if self.timed else 0.0
+
+        if self.key_columns or self.masks or self.trailing or self.seen is not None:
+            rows = [line.split('\t') for line in lines]
+            for position, index in self.key_columns.items():
+                key_set = self.keys[position]
+                for fields in rows:
+                    value = decode_copy_value(fields[index])
+                    if value is not None:
+                        key_set.add(value)
+
+            if self.seen is not None:
+                rows = [fields for fields in rows if not self.is_seen(
+                    tuple([fields[index] for index in self.identity]))]
+                if not rows:
+                    return len(data)
+
+            if self.masks:
+                self.apply_masks(rows, True)
+
+            if self.masks or self.trailing or self.seen is not None:
+                lines = ['\t'.join(fields[:len(fields) - self.trailing]) for fields in rows]
+
+        if self.rows == 0:
+            self.write_header()
+
+        self.write_data('\n'.join(lines) + '\n', started)
+        self.count_rows(len(lines))
+
+        return len(data)
+
+    def apply_masks(self, rows: List[list], encoded: bool) -> None:
+        for index, mask in self.masks.items():
+            if encoded:
+                values = [encode_copy_value(value) for value in
+                          mask.apply([decode_copy_value(fields[index]) for fields in rows])]
+            else:
+                values = mask.apply([None if fields[index] is None else format_key(fields[index])
+                                     for fields in rows])
+
+            for fields, value in zip(rows, values):
+                fields[index] = value
+
+    def write_rows(self, rows: List[tuple]) -> None:
+        self.fetched += len(rows)
+        started = time.perf_counter() if self.timed else 0.0
+
+        for position, index in self.key_columns.items():
+            key_set = self.keys[position]
+            for row in rows:
+                if row[index] is not None:
+                    key_set.add(format_key(row[index]))
+
+        if self.seen is not None:
+            rows = [row for row in rows if not self.is_seen(
+                tuple([format_key(row[index]) for index in self.identity]))]
+
+        if not rows:
+            return
+
+        if self.rows == 0:
+            self.write_header()
+
+        if self.masks:
+            rows = [list(row) for row in rows]
+            self.apply_masks(rows, False)
+
+        self.write_data(''.join(['\t'.join([encode_copy_value(value)
+                                            for value in row[:len(row) - self.trailing]]) + '\n'
+                                 for row in rows]), started)
+        self.count_rows(len(rows))
+
+    def close(self) -> None:
+        if self.rows > 0 and self.framed:
+            self.output.write(f'\\.\n{self.merge[1]};\n\n' if self.merge else '\\.\n\n')
+
+        super().close()
+
+
+class BinaryCopyWriter(RowWriter, io.RawIOBase):
+    def __init__(self,
+                 table: Table,
+                 key_columns: Dict[int, int],
+                 keys: Dict[int, KeySet],
+                 key_store: KeyStore,
+                 output: IO,
+                 timed: bool = False,
+                 seen: Union[Dict[tuple, object], KeySet] = None,
+                 identity: List[int] = None,
+                 trailing: int = 0,
+                 seen_store: KeyStore = None):
+        super().__init__(table, key_columns, keys, key_store, output, timed, seen, identity,
+                         trailing, seen_store)
+        self.decoders = {position: get_binary_decoder(table.get_column_at(position).type)
+                         for position in key_columns.keys()}
+        self.buffer = bytearray()
+        self.header = True
+
+    def write(self, data: bytes) -> int:
+        started = time.perf_counter() if self.timed else 0.0
+        self.buffer += data
+
+        offset = self.read_header()
+        if offset is None:
+            return len(data)
+
+        rows = []
+        while True:
+            row = self.read_row(offset)
+            if row is None:
+                break
+
+            rows.append(row)
+            offset = row[1]
+
+        chunks = self.process_rows(rows)
+        del self.buffer[:offset]
+
+        if chunks:
+            self.write_data(b''.join(chunks), started)
+
+        return len(data)
+
+    def read_header(self) -> Optional[int]:
+        if not self.header:
+            return 0
+
+        if len(self.buffer) < len(BINARY_HEADER):
+            return None
+
+        offset = len(BINARY_HEADER) + struct.unpack_from('!i', self.buffer, 15)[0]
+        if len(self.buffer) < offset:
+            return None
+
+        self.header = False
+        del self.buffer[:offset]
+
+        return 0
+
+    def read_row(self, offset: int) -> Optional[Tuple[int, int, List[Tuple[int, int]]]]:
+        size = len(self.buffer)
+        if offset + 2 > size:
+            return None
+
+        count = struct.unpack_from('!h', self.buffer, offset)[0]
+        if count == -1:
+            return None
+
+        position = offset + 2
+        fields = []
+        for _ in range(count):
+            if position + 4 > size:
+                return None
+
+            length = struct.unpack_from('!i', self.buffer, position)[0]
+            fields.append((position + 4, length))
+            position += 4 + max(length, 0)
+            if position > size:
+                return None
+
+        return offset, position, fields
+
+    def get_value(self, field: Tuple[int, int]) -> Optional[bytes]:
+        start, length = field
+
+        return bytes(self.buffer[start:start + length]) if length >= 0 else None
+
+    def process_rows(self, rows: List[Tuple[int, int, List[Tuple[int, int]]]]) -> List[bytes]:
+        self.fetched += len(rows)
+
+        for position, index in self.key_columns.items():
+            key_set, decode = self.keys[position], self.decoders[position]
+            for row in rows:
+                value = self.get_value(row[2][index])
+                if value is not None:
+                    key_set.add(decode(value))
+
+        if self.seen is not None:
+            rows = [row for row in rows if not self.is_seen(
+                tuple([self.get_value(row[2][index]) for index in self.identity]))]
+
+        if not rows:
+            return []
+
+        self.count_rows(len(rows))
+
+        if not self.trailing:
+            return [bytes(self.buffer[row[0]:row[1]]) for row in rows]
+
+        chunks = []
+        for start, _, fields in rows:
+            kept = len(fields) - self.trailing
+            chunks.append(struct.pack('!h', kept))
+            chunks.append(bytes(self.buffer[start + 2:fields[kept][0] - 4]))
+
+        return chunks
 
 
 class DataGenerator:
     cursor: _cursor
     schema: SchemaGenerator
     options: Options
-    hashes: Dict[str, Dict[int, List]]
+    output: Union[StreamOutput, DirectoryOutput, TargetOutput]
+    row_counts: Dict[str, int]
+    key_store: KeyStore
+    referenced_columns: Dict[str, Set[int]]
+    closure_columns: Dict[str, Set[int]]
+    seen_rows: Dict[str, Dict[tuple, object]]
+    pool: Optional[WorkerPool]
+    stats: Stats
+    checkpoint: Optional[Checkpoint]
+    watermarks: Dict[str, Tuple[Optional[str], Optional[str]]]
+    previous: Dict[str, TableCheckpoint]
+    restored: Set[str]
+    sampling: Sampling
+    table_sampling: Dict[str, Sampling]
+    masking: Masking
+    binary_tables: Set[str]
+    key_tables: Dict[Tuple[int, str, int], Tuple[str, Tuple[KeySet, int]]]
+    shared_rows: Optional[KeyStore]
 
-    def __init__(self, cursor: _cursor, schema: SchemaGenerator, options: Options):
+    def __init__(self,
+                 cursor: _cursor,
+                 schema: SchemaGenerator,
+                 options: Options,
+                 output: Union[StreamOutput, DirectoryOutput, TargetOutput] = None,
+                 pool: WorkerPool = None,
+                 stats: Stats = None,
+                 checkpoint: Checkpoint = None,
+                 shared_rows: KeyStore = None):
         self.cursor = cursor
         self.schema = schema
         self.options = options
-        self.hashes = {}
+        self.output = output or StreamOutput(sys.stdout)
+        self.pool = pool
+        self.stats = stats or Stats()
+        self.checkpoint = checkpoint
+        self.shared_rows = shared_rows
+        self.watermarks = {}
+        self.previous = {}
+        self.restored = set()
+        self.sampling = Sampling.parse(options.sampling)
+        self.table_sampling = {table_name: Sampling.parse(spec, self.sampling.seed)
+                               for table_name, spec in options.table_sampling.items()}
+        self.masking = Masking(options, schema)
+        self.row_counts = {}
+        self.key_store = KeyStore(options.key_memory_budget * 1024 * 1024)
+        self.referenced_columns = {}
+        self.closure_columns = {}
+        self.seen_rows = {}
+        self.cursor_counter = itertools.count(1)
+        self.key_tables = {}
+        self.key_table_counter = itertools.count(1)
 
-    def do_select_with_condition(self, table: Table, where: str = None) -> None:
-        if table.name in self.hashes.keys():
-            if table.name in self.options.custom_conditions.keys() \
-                    or table.name in self.options.dump_full:
+        for table in self.schema.tables:
+            for relation in table.relations:
+                if relation.is_parent() and relation.dest:
+                    self.referenced_columns.setdefault(relation.table_name, set())\
+                        .add(relation.dest)
+
+        self.binary_tables = {table.name for table in self.schema.tables if self.is_binary(table)}
+
+    def do_select_with_condition(self,
+                                 table: Table,
+                                 where: str = None,
+                                 cursor: _cursor = None,
+                                 output: TextIO = None,
+                                 required: bool = False,
+                                 parents: List[Relation] = None) -> None:
+        cursor = cursor or self.cursor
+
+        if table.name in self.row_counts.keys():
+            if not required and (table.name in self.options.custom_conditions.keys()
+                                 or table.name in self.options.dump_full):
                 return
 
-            if table.name in self.options.custom_limits.keys() and \
-                    len(self.hashes[table.name].keys()) >= self.options.custom_limits[table.name]:
+            if not required and table.name in self.options.custom_limits.keys() and \
+                    self.row_counts[table.name] >= self.options.custom_limits[table.name]:
                 return
         else:
-            self.hashes[table.name] = {}
+            self.row_counts[table.name] = 0
 
-        if table.name in self.options.custom_conditions.keys():
+        if table.name in self.options.custom_conditions.keys() and not required:
             where = self.options.custom_conditions[table.name]
 
+        delta = self.get_delta_condition(table) if not required else None
+        if delta:
+            where = f'({where}) AND {delta}' if where else delta
+
+        if where:
+            self.stats.add(table.name, 'condition', where_bytes=len(where.encode('utf-8')))
+
         if not where:
             where = '1=1'
 
-        if table.name in self.options.custom_limits.keys():
-            limit = self.options.custom_limits[table.name]
-        elif table.name in self.options.dump_full:
-            limit = 'ALL'
+        children = self.get_children(table, parents, required)
+        dedup = children and len(parents) > 1 and table.name not in self.seen_rows.keys()
+        if dedup:
+            self.seen_rows[table.name] = {}
+
+        projection = self.get_projection(table)
+
+        with self.stats.phase(table.name, 'condition'):
+            query = self.get_query(table, where, delta, parents, projection, children,
+                                   self.get_limit(table, required), cursor)
+
+        writer = self.open_writer(table, output or sys.stdout, projection)
+
+        if isinstance(writer, BinaryCopyWriter):
+            self.stats.add(table.name, 'query', queries=1)
+            started = time.perf_counter()
+            cursor.copy_expert(f'COPY ({query}) TO STDOUT (FORMAT binary)', writer)
+        elif self.options.extraction == 'copy' or self.output.copy_extraction:
+            self.stats.add(table.name, 'query', queries=1)
+            started = time.perf_counter()
+            cursor.copy_expert(f'COPY ({query}) TO STDOUT', writer)
         else:
-            limit = self.options.limit
+            connection = cursor.connection
+            autocommit = connection.autocommit
+            if autocommit:
+                connection.autocommit = False
 
-        query = f'SELECT DISTINCT * FROM {table.name} WHERE {where} ORDER BY 1 DESC LIMIT {limit}'
-        self.cursor.execute(query)
+            named_cursor = connection.cursor(f'pg_slicer_{next(self.cursor_counter)}')
 
-        for row in self.cursor:
-            key = hash(frozenset(row))
-            if key in self.hashes[table.name].keys():
-                continue
+            try:
+                with self.stats.phase(table.name, 'query'):
+                    named_cursor.execute(self.get_text_query(query, projection))
+
+                self.stats.add(table.name, 'query', queries=1)
+                started = time.perf_counter()
+
+                rows = named_cursor.fetchmany(self.options.batch_size)
+                while rows:
+                    writer.write_rows(rows)
+                    rows = named_cursor.fetchmany(self.options.batch_size)
+            finally:
+                named_cursor.close()
+
+                if autocommit:
+                    connection.rollback()
+                    connection.autocommit = True
+
+        fetch_seconds = time.perf_counter() - started - writer.encode_seconds \
+            - writer.write_seconds
+        writer.close()
+        self.row_counts[table.name] += writer.rows
+
+        if dedup:
+            del self.seen_rows[table.name]
+
+        self.stats.add(table.name, 'fetch', fetch_seconds, rows_fetched=writer.fetched,
+                       rows_kept=writer.rows)
+        self.stats.add(table.name, 'encode', writer.encode_seconds)
+        self.stats.add(table.name, 'write', writer.write_seconds, bytes_written=writer.bytes)
+
+    def get_limit(self, table: Table, required: bool = False) -> Union[int, str]:
+        if required:
+            return 'ALL'
+
+        if table.name in self.options.custom_limits.keys():
+            return self.options.custom_limits[table.name]
+
+        if table.name in self.options.dump_full:
+            return 'ALL'
+
+        return self.options.limit
+
+    def get_children(self,
+                     table: Table,
+                     parents: List[Relation],
+                     required: bool = False) -> Optional[int]:
+        if not parents or required or table.name in self.options.dump_full \
+                or table.name in self.options.custom_conditions.keys():
+            return None
+
+        return self.get_children_limit(table)
+
+    def get_query(self,
+                  table: Table,
+                  where: str,
+                  delta: Optional[str],
+                  parents: List[Relation],
+                  projection: Projection,
+                  children: Optional[int],
+                  limit: Union[int, str],
+                  cursor: _cursor) -> str:
+        if children:
+            return self.get_children_query(table, parents, projection.columns, delta, children,
+                                           cursor)
+
+        keyed = bool(parents) and table.name not in self.options.custom_conditions.keys()
+
+        return self.table_sampling.get(table.name, self.sampling)\
+            .get_query(table, projection.columns, where, limit, cursor,
+                       self.get_partition_count(table), keyed)
+
+    @staticmethod
+    def get_text_query(query: str, projection: Projection) -> str:
+        columns = ', '.join([f'pg_slicer_rows.{name}::text' for name in projection.names])
+
+        return f'SELECT {columns} FROM ({query}) AS pg_slicer_rows'
+
+    def get_projection(self, table: Table) -> Projection:
+        mask = self.masking.get(table.name)
+        positions = {column.position: index for index, column in enumerate(table.columns)}
+        extras = []
+
+        def get_field(position: int) -> int:
+            if not mask or position not in mask.sql.keys():
+                return positions[position]
 
-            line = []
-            for col in row:
-                if col is None:
-                    line.append('\\N')
-                elif type(col) is bool:
-                    line.append('t' if col else 'f')
-                elif type(col) is dict:
-                    line.append(json.dumps(col))
-                elif type(col) is not str:
-                    line.append(str(col)
-                                .replace('\\', '\\\\')
-                                .replace('\r\n', '\n')
-                                .replace('\n', '\\r\\n')
-                                .replace('\t', '\\t'))
-                else:
-                    line.append(col
-                                .replace('\\', '\\\\')
-                                .replace('\r\n', '\n')
-                                .replace('\n', '\\r\\n')
-                                .replace('\t', '\\t'))
-
-            self.hashes[table.name][key] = line
-
-    def prepare_condition(self, table: Table, relation: Relation) -> str:
-        values = []
-
-        if relation.table_name not in self.hashes.keys():
+            name = table.get_column_at(position).name
+            if name not in extras:
+                extras.append(name)
+
+            return len(table.columns) + extras.index(name)
+
+        key_columns = {position: get_field(position)
+                       for position in self.referenced_columns.get(table.name, set())
+                       | self.closure_columns.get(table.name, set())
+                       if position in positions}
+
+        identity_fields = []
+        if self.get_seen(table) is not None:
+            identity = table.get_identity()
+            if identity:
+                identity_fields = [get_field(column.position) for column in identity]
+            else:
+                row_columns = ['tableoid', 'ctid'] if table.partitions else ['ctid']
+                extras += row_columns
+                identity_fields = [len(table.columns) + len(extras) - len(row_columns) + index
+                                   for index in range(len(row_columns))]
+
+        columns = [mask.get_expression(column) for column in table.columns] \
+            if mask and mask.sql else ['*']
+        columns += [f'{table.name}.{name} AS pg_slicer_{name}' for name in extras]
+        masks = {positions[position]: python_mask
+                 for position, python_mask in mask.python.items()} if mask else {}
+
+        names = [column.name for column in table.columns] + [f'pg_slicer_{name}' for name in extras]
+
+        return Projection(', '.join(columns), key_columns, identity_fields, len(extras), masks,
+                          names)
+
+    def open_writer(self, table: Table, output: IO, projection: Projection) \
+            -> Union[CopyWriter, BinaryCopyWriter]:
+        keys = {position: self.key_store.create(table.name, position,
+                                                table.get_column_at(position).type)
+                for position in projection.key_columns.keys()}
+
+        for key_set in keys.values():
+            key_set.sealed = False
+
+        if table.name in self.binary_tables:
+            return BinaryCopyWriter(table, projection.key_columns, keys, self.key_store, output,
+                                    self.stats.enabled, self.get_seen(table),
+                                    projection.identity, projection.trailing, self.shared_rows)
+
+        return CopyWriter(table, projection.key_columns, keys, self.key_store, output,
+                          self.output.copy_framing, self.stats.enabled,
+                          self.get_seen(table), projection.identity,
+                          projection.trailing, self.get_merge(table), projection.masks,
+                          self.shared_rows)
+
+    def get_seen(self, table: Table) -> Union[Dict[tuple, object], KeySet, None]:
+        if self.shared_rows is not None and table.get_identity():
+            key_set = self.shared_rows.create(table.name, 0, 'text')
+            key_set.sealed = True
+
+            return key_set
+
+        return self.seen_rows.get(table.name)
+
+    def is_binary(self, table: Table) -> bool:
+        if self.options.table_copy_formats.get(table.name, self.options.copy_format) != 'binary' \
+                or not self.output.binary:
+            return False
+
+        mask = self.masking.get(table.name)
+        if mask and mask.python or self.output.copy_framing and self.get_merge(table):
+            return False
+
+        positions = self.referenced_columns.get(table.name, set()) \
+            | {relation.src for relation in table.relations if relation.is_parent()}
+
+        return all([get_binary_decoder(table.get_column_at(position).type) is not None
+                    for position in positions if table.get_column_at(position)])
+
+    def get_partition_count(self, table: Table) -> Optional[int]:
+        if table.name in self.seen_rows.keys() and not table.get_identity():
+            return None
+
+        return self.options.custom_partitions.get(table.name, self.options.partitions)
+
+    def get_children_limit(self, table: Table) -> Optional[int]:
+        if table.name in self.options.custom_children.keys():
+            return self.options.custom_children[table.name]
+
+        return self.options.children
+
+    def get_children_query(self,
+                           table: Table,
+                           parents: List[Relation],
+                           columns: str,
+                           where: Optional[str],
+                           limit: int,
+                           cursor: _cursor = None) -> str:
+        order = self.table_sampling.get(table.name, self.sampling).get_order(table)
+        queries = []
+
+        for relation in parents:
+            column = table.get_column_at(relation.src)
+            keys = self.get_key_relation(column,
+                                         self.key_store.get(relation.table_name, relation.dest),
+                                         cursor or self.cursor)
+            condition = f'{column.name} = parent.key' + (f' AND {where}' if where else '')
+            queries.append(f'SELECT child.* FROM {keys} '
+                           f'AS parent(key) CROSS JOIN LATERAL (SELECT {columns} '
+                           f'FROM {table.name} WHERE {condition} ORDER BY {order} '
+                           f'LIMIT {limit}) child')
+
+        return ' UNION ALL '.join(queries)
+
+    def get_merge(self, table: Table) -> Optional[Tuple[str, str]]:
+        if not self.options.since_checkpoint:
+            return None
+
+        identity = table.get_identity()
+
+        return get_merge_statements(table.name, [column.name for column in table.columns],
+                                    [column.name for column in identity] if identity else [])
+
+    def get_watermark_column(self, table: Table) -> Optional[str]:
+        if table.name in self.options.watermark_columns.keys():
+            return self.options.watermark_columns[table.name]
+
+        identity = table.get_identity()
+        if identity and len(identity) == 1 and identity[0].type in INT_TYPES:
+            return identity[0].name
+
+        return None
+
+    def record_watermark(self, table: Table, cursor: _cursor = None) -> None:
+        column = self.get_watermark_column(table)
+        if not column or table.name in self.watermarks.keys():
+            return
+
+        cursor = cursor or self.cursor
+
+        with self.stats.phase(table.name, 'query'):
+            cursor.execute(f'SELECT max({column})::text FROM {table.name}')
+            self.watermarks[table.name] = (column, cursor.fetchone()[0])
+
+        self.stats.add(table.name, 'query', queries=1)
+
+    def get_delta_condition(self, table: Table) -> Optional[str]:
+        previous = self.previous.get(table.name)
+        if not previous:
+            return None
+
+        if previous.watermark is not None \
+                and previous.watermark_column == self.get_watermark_column(table):
+            return f'{previous.watermark_column} > \'%s\'' \
+                % previous.watermark.replace('\'', '\'\'')
+
+        return None if table.get_identity() else 'false'
+
+    def prepare_condition(self, table: Table, relation: Relation, cursor: _cursor = None) -> str:
+        if relation.table_name not in self.row_counts.keys():
             return ''
 
         if not relation.src or not relation.dest:
@@ -88,19 +801,47 @@ class DataGenerator:
         if not rel_column or rel_column.is_null:
             return ''
 
-        for row in self.hashes[relation.table_name].values():
-            value = row[relation.dest - 1]
-            if type(value) is not int:
-                values.append(f'\'{value}\'')
-            else:
-                values.append(value)
+        key_set = self.key_store.get(relation.table_name, relation.dest)
+        if not key_set or self.options.key_propagation in [None, 'inline']:
+            return self.generate_condition(rel_column, key_set.to_sql() if key_set else None)
+
+        if self.options.key_propagation == 'array':
+            return f' {rel_column.name} = ANY({key_set.to_array_sql(rel_column.type)})'
+
+        return f' {rel_column.name} IN (SELECT key ' \
+               f'FROM {self.upload_keys(rel_column, key_set, cursor or self.cursor)})'
+
+    def get_key_relation(self, column: Column, key_set: KeySet, cursor: _cursor) -> str:
+        if self.options.key_propagation == 'array':
+            return f'unnest({key_set.to_array_sql(column.type)})'
+
+        if self.options.key_propagation == 'temp-table':
+            return self.upload_keys(column, key_set, cursor)
+
+        return f'unnest(ARRAY[{key_set.to_sql()}]::{column.type}[])'
+
+    def upload_keys(self, column: Column, key_set: KeySet, cursor: _cursor) -> str:
+        key = (id(cursor.connection), key_set.table_name, key_set.position)
+        name, uploaded = self.key_tables.get(key, (None, None))
+        if uploaded == (key_set, len(key_set)):
+            return name
+
+        if name:
+            cursor.execute(f'TRUNCATE {name}')
+        else:
+            name = f'pg_slicer_keys_{next(self.key_table_counter)}'
+            cursor.execute(f'CREATE TEMPORARY TABLE {name} (key {column.type})')
+
+        cursor.copy_expert(f'COPY {name} FROM STDIN', io.StringIO(key_set.to_copy()))
+        cursor.execute(f'ANALYZE {name}')
+        self.key_tables[key] = (name, (key_set, len(key_set)))
 
-        return self.generate_condition(rel_column, values)
+        return name
 
     @staticmethod
-    def generate_condition(column: Column, values: list = None) -> str:
+    def generate_condition(column: Column, values: str = None) -> str:
         null_part = f' {column.name} IS NULL' if column.is_null else ''
-        cond_part = f' {column.name} IN (%s)' % ','.join(values) if values else ''
+        cond_part = f' {column.name} IN ({values})' if values else ''
 
         if cond_part and null_part:
             cond_part += ' OR'
@@ -109,76 +850,344 @@ class DataGenerator:
 
     @staticmethod
     def get_column_at(table: Table, pos: int) -> Optional[Column]:
-        for column in table.columns:
-            if column.position == pos:
-                return column
-
-        return None
+        return table.get_column_at(pos)
 
-    def select_from(self, table_name: str) -> None:
+    def select_from(self, table_name: str, cursor: _cursor = None, output: TextIO = None) -> None:
         table = self.schema.get_table(table_name)
         conditions = []
+        parents = []
 
-        for relation in table.relations:
-            if relation.is_child():
-                continue
+        if self.checkpoint:
+            self.record_watermark(table, cursor)
 
-            rel_column = self.get_column_at(table, relation.src)
-            if not rel_column or rel_column.is_null:
-                continue
+        with self.stats.phase(table_name, 'condition'):
+            for relation in table.relations:
+                if relation.is_child():
+                    continue
+
+                rel_column = self.get_column_at(table, relation.src)
+                if not rel_column or rel_column.is_null:
+                    continue
 
-            condition = self.prepare_condition(table, relation)
-            if condition:
-                conditions.append(f'({condition})')
+                condition = self.prepare_condition(table, relation, cursor)
+                if condition:
+                    conditions.append(f'({condition})')
+                    parents.append(relation)
 
         condition = ' OR '.join(conditions) if len(conditions) > 0 else None
-        self.do_select_with_condition(table, condition)
+        self.do_select_with_condition(table, condition, cursor, output, False, parents)
 
     def generate_data(self):
-        table_layers = [[table for table in self.schema.get_root_tables()]]
-        processed_tables = [table for table in self.schema.get_root_tables()]
-        while len(processed_tables) < len(self.schema.tables):
-            new_layer = []
+        graph = DependencyGraph(self.schema.get_data_tables(), required_only=True)
+        layers = graph.get_layers()
+        required = {}
+
+        try:
+            if self.checkpoint:
+                self.restore_checkpoint(layers)
+
+            if self.options.since_checkpoint:
+                required = self.get_required_relations([table.name for table
+                                                        in self.schema.get_data_tables()])
+                self.track_required_parents(required)
+
+            for layer, components in enumerate(layers):
+                components = [component for component in components
+                              if not all([table in self.restored for table in component])]
+
+                if self.pool:
+                    tasks = []
+                    for component in components:
+                        partitions = self.get_parallel_partitions(component)
+                        tasks += [(component, partition) for partition in partitions] \
+                            if partitions else [(component, None)]
+
+                    results = self.pool.map(
+                        lambda task, cursor: self.extract_partition(task[1], layer, cursor)
+                        if task[1] else self.extract_component(graph, task[0], layer, cursor),
+                        tasks)
+
+                    for streams in results:
+                        for table, stream in streams:
+                            self.close_table(table, layer, stream)
+
+                    continue
+
+                for component in components:
+                    self.extract_component(graph, component, layer)
 
-            for table in self.schema.tables:
-                if table.name in processed_tables:
+            if required:
+                self.select_required_parents(required, len(layers))
+        finally:
+            self.key_store.close()
+
+    def restore_checkpoint(self, layers: List[List[List[str]]]) -> None:
+        for components in layers:
+            for component in components:
+                if not self.options.since_checkpoint \
+                        and not all([table in self.checkpoint.tables for table in component]):
                     continue
 
-                add_to_new_layer = True
+                for table_name in component:
+                    if table_name in self.checkpoint.tables.keys():
+                        self.restore_table(self.checkpoint.tables[table_name])
 
-                for relation in table.relations:
-                    if relation.is_child():
-                        continue
+    def restore_table(self, table_checkpoint: TableCheckpoint) -> None:
+        table = self.schema.get_table(table_checkpoint.name)
+        key_sets = {}
 
-                    if relation.table_name in processed_tables:
-                        continue
+        for position, value in self.checkpoint.get_keys(table.name):
+            if position not in key_sets.keys():
+                column = table.get_column_at(position)
+                key_sets[position] = self.key_store.create(table.name, position, column.type) \
+                    if column else None
 
-                    rel_column = self.get_column_at(table, relation.src)
-                    if not rel_column or rel_column.is_null:
-                        continue
+            if key_sets[position] is not None:
+                key_sets[position].add(value)
 
-                    if relation.table_name in new_layer \
-                            or relation.table_name not in processed_tables:
-                        add_to_new_layer = False
+        for key_set in key_sets.values():
+            if key_set is not None:
+                key_set.sealed = True
 
-                        break
+        self.key_store.enforce_budget()
 
-                if add_to_new_layer:
-                    new_layer.append(table.name)
-                    processed_tables.append(table.name)
+        if self.options.since_checkpoint:
+            self.previous[table.name] = table_checkpoint
 
-            if new_layer:
-                table_layers.append(new_layer)
-            else:
-                break
+            return
+
+        self.restored.add(table.name)
+        self.row_counts[table.name] = table_checkpoint.rows
+        self.watermarks[table.name] = (table_checkpoint.watermark_column,
+                                       table_checkpoint.watermark)
+        self.output.restore_table(table.name, table_checkpoint.layer, table_checkpoint.rows,
+                                  table.name in self.binary_tables)
+
+    def extract_component(self,
+                          graph: DependencyGraph,
+                          component: List[str],
+                          layer: int,
+                          cursor: _cursor = None) -> List[Tuple[str, TextIO]]:
+        if self.options.since_checkpoint or not graph.is_cyclic(component):
+            streams = [(table_name, self.extract_table(table_name, layer, cursor))
+                       for table_name in component]
+
+            return [(table_name, stream) for table_name, stream in streams if stream]
+
+        return self.extract_cycle(component, layer, cursor)
+
+    def get_parallel_partitions(self, component: List[str]) -> List[str]:
+        table = self.schema.get_table(component[0])
+        if len(component) > 1 or not table.partitions or table.name not in self.options.dump_full \
+                or self.checkpoint or self.options.since_checkpoint:
+            return []
+
+        if table.name in self.options.custom_conditions.keys() \
+                or table.name in self.options.custom_limits.keys() \
+                or table.name in self.options.table_copy_formats.keys() \
+                or table.name in self.referenced_columns.keys() or self.masking.get(table.name):
+            return []
+
+        return self.get_leaf_partitions(table)
+
+    def get_leaf_partitions(self, table: Table) -> List[str]:
+        leaves = []
+        for partition_name in table.partitions:
+            partition = self.schema.get_table(partition_name)
+            leaves += self.get_leaf_partitions(partition) if partition.partitions \
+                else [partition_name]
+
+        return leaves
+
+    def extract_partition(self, partition_name: str, layer: int, cursor: _cursor = None) \
+            -> List[Tuple[str, TextIO]]:
+        stream = self.open_table(partition_name, layer)
+
+        try:
+            self.do_select_with_condition(self.schema.get_table(partition_name), None, cursor,
+                                          stream, True)
+        except BaseException:
+            self.output.discard_table(partition_name, stream)
+            raise
+
+        if self.pool and self.output.ordered:
+            return [(partition_name, stream)]
+
+        self.close_table(partition_name, layer, stream)
+
+        return []
+
+    def extract_cycle(self, component: List[str], layer: int, cursor: _cursor = None) \
+            -> List[Tuple[str, TextIO]]:
+        relations = self.get_required_relations(component)
+        self.track_required_parents(relations)
+
+        for table_name in component:
+            self.seen_rows[table_name] = {}
+
+        streams = [(table_name, self.open_table(table_name, layer)) for table_name in component]
+
+        try:
+            for table_name, stream in streams:
+                self.select_from(table_name, cursor, stream)
+
+            while self.select_missing_parents(relations, dict(streams), layer, cursor):
+                pass
+        except BaseException:
+            for table_name, stream in streams:
+                self.output.discard_table(table_name, stream)
+
+            raise
+        finally:
+            self.untrack_required_parents(relations)
+
+            for table_name in component:
+                del self.seen_rows[table_name]
+
+        if self.pool and self.output.ordered:
+            return streams
+
+        for table_name, stream in streams:
+            self.close_table(table_name, layer, stream)
+
+        return []
+
+    def get_required_relations(self, table_names: List[str]) -> Dict[str, List[Relation]]:
+        members = set(table_names)
+        relations = {}
+
+        for table_name in table_names:
+            table = self.schema.get_table(table_name)
+            relations[table_name] = [relation for relation in table.relations
+                                     if relation.is_parent() and relation.table_name in members
+                                     and relation.src and relation.dest
+                                     and self.is_required(table, relation)]
+
+        return relations
 
-        for table_layer in table_layers:
-            for table in table_layer:
-                self.select_from(table)
+    def track_required_parents(self, relations: Dict[str, List[Relation]]) -> None:
+        for table_name, table_relations in relations.items():
+            table = self.schema.get_table(table_name)
+            self.closure_columns[table_name] = {relation.src for relation in table_relations}
 
-                if len(self.hashes[table].keys()) > 0:
-                    print(f'COPY {table} FROM stdin;')
-                    for row in self.hashes[table].values():
-                        if row:
-                            print('\t'.join(row))
-                    print('\\.\n')
+            for position in self.closure_columns[table_name]:
+                self.key_store.create(table_name, position,
+                                      table.get_column_at(position).type).delta = []
+
+    def untrack_required_parents(self, relations: Dict[str, List[Relation]]) -> None:
+        for table_name in relations.keys():
+            for position in self.closure_columns.pop(table_name):
+                self.key_store.get(table_name, position).delta = None
+
+    def select_required_parents(self, relations: Dict[str, List[Relation]], layer: int) -> None:
+        streams = {}
+
+        try:
+            while self.select_missing_parents(relations, streams, layer):
+                pass
+        except BaseException:
+            for table_name, stream in streams.items():
+                self.output.discard_table(table_name, stream)
+
+            raise
+
+        for table_name, stream in streams.items():
+            self.close_table(table_name, layer, stream)
+
+    def select_missing_parents(self,
+                               relations: Dict[str, List[Relation]],
+                               streams: Dict[str, TextIO],
+                               layer: int,
+                               cursor: _cursor = None) -> bool:
+        missing: Dict[Tuple[str, int], Set[Any]] = {}
+
+        for table_name, table_relations in relations.items():
+            for relation in table_relations:
+                key_set = self.key_store.get(relation.table_name, relation.dest)
+                missing.setdefault((relation.table_name, relation.dest), set()).update(
+                    [value for value in self.key_store.get(table_name, relation.src).delta
+                     if not key_set or value not in key_set])
+
+        for table_name, table_relations in relations.items():
+            for relation in table_relations:
+                self.key_store.get(table_name, relation.src).delta = []
+
+        conditions = {}
+        for (table_name, position), values in missing.items():
+            if not values:
+                continue
+
+            column = self.schema.get_table(table_name).get_column_at(position)
+            key_set = self.key_store.create(table_name, position, column.type)
+            conditions.setdefault(table_name, []).append(
+                f'({column.name} IN (%s))' % ','.join([key_set.literal(value)
+                                                       for value in sorted(values)]))
+
+        for table_name, table_conditions in conditions.items():
+            with self.stats.phase(table_name, 'condition'):
+                where = ' OR '.join(table_conditions)
+
+            if table_name not in streams.keys():
+                streams[table_name] = self.open_table(table_name, layer)
+
+            self.do_select_with_condition(self.schema.get_table(table_name), where, cursor,
+                                          streams[table_name], True)
+
+        return len(conditions) > 0
+
+    @staticmethod
+    def is_required(table: Table, relation: Relation) -> bool:
+        column = table.get_column_at(relation.src)
+
+        return column is not None and not column.is_null
+
+    def open_table(self, table_name: str, layer: int) -> IO:
+        binary = table_name in self.binary_tables
+        stream = self.output.open_table(table_name, layer,
+                                        self.pool is not None or self.shared_rows is not None,
+                                        self.get_merge(self.schema.get_table(table_name)), binary)
+
+        if binary:
+            stream.write(BINARY_HEADER)
+
+        return stream
+
+    def close_table(self, table_name: str, layer: int, stream: IO) -> None:
+        if table_name in self.binary_tables:
+            stream.write(BINARY_TRAILER)
+
+        if not self.checkpoint:
+            self.output.close_table(table_name, stream, self.row_counts[table_name])
+
+            return
+
+        previous = self.previous.get(table_name)
+        watermark_column, watermark = self.watermarks.get(table_name, (None, None))
+        key_sets = [self.key_store.get(table_name, position)
+                    for position in self.referenced_columns.get(table_name, set())]
+        table_checkpoint = TableCheckpoint(
+            table_name, previous.layer if previous else layer,
+            self.row_counts[table_name] + (previous.rows if previous else 0),
+            watermark_column, watermark)
+
+        self.output.close_table(table_name, stream, self.row_counts[table_name],
+                                lambda: self.checkpoint.save_table(
+                                    table_checkpoint,
+                                    [key_set for key_set in key_sets if key_set is not None]))
+
+    def extract_table(self, table_name: str, layer: int, cursor: _cursor = None) \
+            -> Optional[TextIO]:
+        stream = self.open_table(table_name, layer)
+
+        try:
+            self.select_from(table_name, cursor, stream)
+        except BaseException:
+            self.output.discard_table(table_name, stream)
+            raise
+
+        if self.pool and self.output.ordered:
+            return stream
+
+        self.close_table(table_name, layer, stream)
+
+        return None
@@ -0,0 +1,109 @@
+from typing import Dict, List, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from schema_generator import Table
+
+
+class DependencyGraph:
+    nodes: List[str]
+    parents: Dict[str, List[str]]
+
+    def __init__(self, tables: List['Table'], required_only: bool = False):
+        self.nodes = [table.name for table in tables]
+        self.parents = {}
+        known = set(self.nodes)
+
+        for table in tables:
+            parents = []
+            for relation in table.relations:
+                if not relation.is_parent() or relation.table_name not in known:
+                    continue
+
+                if required_only:
+                    column = table.get_column_at(relation.src) if relation.src else None
+                    if not column or column.is_null:
+                        continue
+
+                if relation.table_name not in parents:
+                    parents.append(relation.table_name)
+
+            self.parents[table.name] = parents
+
+    def is_cyclic(self, component: List[str]) -> bool:
+        return len(component) > 1 or component[0] in self.parents[component[0]]
+
+    def get_components(self) -> List[List[str]]:
+        index: Dict[str, int] = {}
+        lowlink: Dict[str, int] = {}
+        on_stack: Set[str] = set()
+        stack: List[str] = []
+        components = []
+
+        for root in self.nodes:
+            if root in index:
+                continue
+
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.parents[root]))]
+
+            while work:
+                node, parents = work[-1]
+
+                for parent in parents:
+                    if parent not in index:
+                        index[parent] = lowlink[parent] = len(index)
+                        stack.append(parent)
+                        on_stack.add(parent)
+                        work.append((parent, iter(self.parents[parent])))
+
+                        break
+
+                    if parent in on_stack:
+                        lowlink[node] = min(lowlink[node], index[parent])
+                else:
+                    work.pop()
+                    if work:
+                        lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+
+                        components.append(component)
+
+        return components
+
+    def get_layers(self) -> List[List[List[str]]]:
+        order = {name: position for position, name in enumerate(self.nodes)}
+        component_of = {}
+        levels = []
+        layers: List[List[List[str]]] = []
+
+        for component_index, component in enumerate(self.get_components()):
+            component.sort(key=order.get)
+            level = 0
+            for member in component:
+                component_of[member] = component_index
+
+            for member in component:
+                for parent in self.parents[member]:
+                    if component_of[parent] != component_index:
+                        level = max(level, levels[component_of[parent]] + 1)
+
+            levels.append(level)
+            while len(layers) <= level:
+                layers.append([])
+
+            layers[level].append(component)
+
+        for layer in layers:
+            layer.sort(key=lambda component: order[component[0]])
+
+        return layers
@@ -0,0 +1,293 @@
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+INT_TYPES = ['smallint', 'integer', 'bigint']
+
+
+class IntStorage:
+    EMPTY = -2 ** 63
+    HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+    def __init__(self):
+        self.slots = array('q', [self.EMPTY]) * 16
+        self.mask = len(self.slots) - 1
+        self.size = 0
+        self.has_empty = False
+
+    def find(self, value: int) -> int:
+        slot = ((value * self.HASH_MULTIPLIER) >> 17) & self.mask
+        while self.slots[slot] != value and self.slots[slot] != self.EMPTY:
+            slot = (slot + 1) & self.mask
+
+        return slot
+
+    def add(self, value: int) -> bool:
+        if value == self.EMPTY:
+            added = not self.has_empty
+            self.has_empty = True
+            self.size += added
+
+            return added
+
+        slot = self.find(value)
+        if self.slots[slot] == value:
+            return False
+
+        self.slots[slot] = value
+        self.size += 1
+
+        if self.size * 2 > len(self.slots):
+            self.grow()
+
+        return True
+
+    def grow(self) -> None:
+        old_slots = self.slots
+        self.slots = array('q', [self.EMPTY]) * (len(old_slots) * 2)
+        self.mask = len(self.slots) - 1
+
+        for value in old_slots:
+            if value != self.EMPTY:
+                self.slots[self.find(value)] = value
+
+    def __contains__(self, value: int) -> bool:
+        if value == self.EMPTY:
+            return self.has_empty
+
+        return self.slots[self.find(value)] == value
+
+    def __iter__(self) -> Iterator[int]:
+        if self.has_empty:
+            yield self.EMPTY
+
+        for value in self.slots:
+            if value != self.EMPTY:
+                yield value
+
+    def __len__(self) -> int:
+        return self.size
+
+    def nbytes(self) -> int:
+        return len(self.slots) * self.slots.itemsize
+
+
+class TextStorage:
+    SLOT_SIZE = 40
+
+    def __init__(self):
+        self.values = set()
+        self.bytes = 0
+
+    def add(self, value: str) -> bool:
+        if value in self.values:
+            return False
+
+        self.values.add(value)
+        self.bytes += sys.getsizeof(value) + self.SLOT_SIZE
+
+        return True
+
+    def __contains__(self, value: str) -> bool:
+        return value in self.values
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def nbytes(self) -> int:
+        return self.bytes
+
+
+class SqliteStorage:
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS keys (v PRIMARY KEY) WITHOUT ROWID')
+        self.size = 0
+
+    def add(self, value: Any) -> bool:
+        added = self.connection.execute('INSERT OR IGNORE INTO keys VALUES (?)', (value,))\
+                    .rowcount > 0
+        self.size += added
+
+        return added
+
+    def update(self, values: Iterator[Any]) -> None:
+        self.connection.execute('BEGIN')
+        self.connection.executemany('INSERT OR IGNORE INTO keys VALUES (?)',
+                                    ((value,) for value in values))
+        self.connection.execute('COMMIT')
+        self.size = self.connection.execute('SELECT count(*) FROM keys').fetchone()[0]
+
+    def __contains__(self, value: Any) -> bool:
+        return self.connection.execute('SELECT 1 FROM keys WHERE v = ?', (value,))\
+                   .fetchone() is not None
+
+    def __iter__(self) -> Iterator[Any]:
+        return (row[0] for row in self.connection.execute('SELECT v FROM keys'))
+
+    def __len__(self) -> int:
+        return self.size
+
+    @staticmethod
+    def nbytes() -> int:
+        return 0
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class KeySet:
+    def __init__(self, table_name: str, position: int, column_type: str):
+        self.table_name = table_name
+        self.position = position
+        self.is_int = column_type in INT_TYPES
+        self.storage = IntStorage() if self.is_int else TextStorage()
+        self.spilled = False
+        self.sealed = False
+        self.lock = threading.RLock()
+        self.sql_cache: Optional[Tuple[int, str]] = None
+        self.array_cache: Optional[Tuple[int, str]] = None
+        self.delta: Optional[List[Any]] = None
+
+    def normalize(self, value: Any) -> Any:
+        if self.is_int:
+            return int(value)
+
+        return value if type(value) is str else str(value)
+
+    def add(self, value: Any) -> bool:
+        value = self.normalize(value)
+
+        with self.lock:
+            added = self.storage.add(value)
+
+        if added and self.delta is not None:
+            self.delta.append(value)
+
+        return added
+
+    def __contains__(self, value: Any) -> bool:
+        with self.lock:
+            return self.normalize(value) in self.storage
+
+    def __iter__(self) -> Iterator[Any]:
+        with self.lock:
+            yield from self.storage
+
+    def __len__(self) -> int:
+        return len(self.storage)
+
+    def nbytes(self) -> int:
+        return self.storage.nbytes()
+
+    def literal(self, value: Any) -> str:
+        if self.is_int:
+            return str(value)
+
+        return '\'%s\'' % value.replace('\'', '\'\'')
+
+    def to_sql(self) -> str:
+        with self.lock:
+            if self.sql_cache is None or self.sql_cache[0] != len(self):
+                self.sql_cache = (len(self), ','.join([self.literal(value) for value in self]))
+
+            return self.sql_cache[1]
+
+    def element(self, value: Any) -> str:
+        if self.is_int:
+            return str(value)
+
+        return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+    def to_array_sql(self, column_type: str) -> str:
+        with self.lock:
+            if self.array_cache is None or self.array_cache[0] != len(self):
+                elements = ','.join([self.element(value) for value in self])
+                self.array_cache = (len(self), '{%s}' % elements.replace('\'', '\'\''))
+
+            return f'\'{self.array_cache[1]}\'::{column_type}[]'
+
+    def to_copy(self) -> str:
+        with self.lock:
+            if self.is_int:
+                return ''.join([f'{value}\n' for value in self])
+
+            return ''.join(['%s\n' % value.replace('\\', '\\\\').replace('\n', '\\n')
+                            .replace('\r', '\\r').replace('\t', '\\t') for value in self])
+
+    def spill(self, path: str) -> None:
+        with self.lock:
+            if self.spilled:
+                return
+
+            storage = SqliteStorage(path)
+            storage.update(iter(self.storage))
+            self.storage = storage
+            self.spilled = True
+
+    def close(self) -> None:
+        if self.spilled:
+            self.storage.close()
+
+
+class KeyStore:
+    key_sets: Dict[Tuple[str, int], KeySet]
+
+    def __init__(self, memory_budget: int):
+        self.memory_budget = memory_budget
+        self.key_sets = {}
+        self.lock = threading.Lock()
+        self.directory = None
+        self.spill_counter = 0
+
+    def create(self, table_name: str, position: int, column_type: str) -> KeySet:
+        with self.lock:
+            if (table_name, position) not in self.key_sets:
+                self.key_sets[(table_name, position)] = KeySet(table_name, position, column_type)
+
+            return self.key_sets[(table_name, position)]
+
+    def put(self, key_set: KeySet) -> None:
+        with self.lock:
+            self.key_sets[(key_set.table_name, key_set.position)] = key_set
+
+    def get(self, table_name: str, position: int) -> Optional[KeySet]:
+        return self.key_sets.get((table_name, position))
+
+    def nbytes(self) -> int:
+        return sum([key_set.nbytes() for key_set in list(self.key_sets.values())])
+
+    def enforce_budget(self, own_key_sets: List[KeySet] = None) -> None:
+        if self.nbytes() <= self.memory_budget:
+            return
+
+        with self.lock:
+            candidates = [key_set for key_set in self.key_sets.values()
+                          if not key_set.spilled
+                          and (key_set.sealed or key_set in (own_key_sets or []))]
+
+            for key_set in sorted(candidates, key=lambda k: k.nbytes(), reverse=True):
+                if self.nbytes() <= self.memory_budget:
+                    break
+
+                if not self.directory:
+                    self.directory = tempfile.mkdtemp(prefix='pg-slicer-keys-')
+
+                self.spill_counter += 1
+                key_set.spill(f'{self.directory}/{self.spill_counter}.sqlite')
+
+    def close(self) -> None:
+        for key_set in self.key_sets.values():
+            key_set.close()
+
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,290 @@
+import hashlib
+import re
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from options import Options
+from schema_generator import Column, SchemaGenerator, Table
+
+TEXT_TYPE_RE = re.compile(r'^(text|character varying|character|citext)(\((\d+)\))?$')
+BYTES_TYPES = ['bytea']
+HASH_INT_TYPES = {
+    'smallint': (8, 32, ' & 32767)::smallint'),
+    'integer': (8, 32, ' & 2147483647)'),
+    'bigint': (15, 60, ')'),
+}
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def keep_format(value: str, salt: str) -> str:
+    noise = hashlib.shake_256((salt + value).encode('utf-8')).digest(len(value))
+    masked = []
+
+    for char, byte in zip(value, noise):
+        if '0' <= char <= '9':
+            masked.append(chr(ord('0') + byte % 10))
+        elif 'a' <= char <= 'z':
+            masked.append(chr(ord('a') + byte % 26))
+        elif 'A' <= char <= 'Z':
+            masked.append(chr(ord('A') + byte % 26))
+        else:
+            masked.append(char)
+
+    return ''.join(masked)
+
+
+class MaskRule:
+    METHODS = ['hash', 'fake', 'null', 'truncate', 'keep_format']
+
+    def __init__(self, method: str, length: int = None, dictionary: str = None):
+        if method not in self.METHODS:
+            raise ValueError(f'unknown masking method: {method}')
+
+        if method == 'truncate' and not length:
+            raise ValueError('truncate masking requires a length')
+
+        if method == 'fake' and not dictionary:
+            raise ValueError('fake masking requires a dictionary')
+
+        self.method = method
+        self.length = int(length) if length else None
+        self.dictionary = dictionary
+
+    @classmethod
+    def parse(cls, spec: Union[None, str, Dict[str, Any]]) -> 'MaskRule':
+        if spec is None:
+            return cls('null')
+
+        if isinstance(spec, dict):
+            return cls(spec.get('method', 'hash'), spec.get('length'), spec.get('dictionary'))
+
+        method, _, argument = str(spec).partition(':')
+        if method == 'truncate':
+            return cls(method, length=argument or None)
+
+        return cls(method, dictionary=argument or None)
+
+
+class ColumnPolicy:
+    POLICIES = ['exclude', 'truncate', 'placeholder']
+
+    def __init__(self, policy: str, length: int = None, value: Any = None):
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown column policy: {policy}')
+
+        if policy == 'truncate' and not length:
+            raise ValueError('truncate policy requires a length')
+
+        if policy == 'placeholder' and value is None:
+            raise ValueError('placeholder policy requires a value')
+
+        self.policy = policy
+        self.length = int(length) if length else None
+        self.value = str(value) if value is not None else None
+
+    @classmethod
+    def parse(cls, spec: Union[None, str, Dict[str, Any]]) -> 'ColumnPolicy':
+        if spec is None:
+            return cls('exclude')
+
+        if isinstance(spec, dict):
+            return cls(spec.get('policy', 'exclude'), spec.get('length'), spec.get('value'))
+
+        policy, separator, argument = str(spec).partition(':')
+        if policy == 'truncate':
+            return cls(policy, length=argument or None)
+
+        return cls(policy, value=argument if separator else None)
+
+
+class PythonMask:
+    def __init__(self, function: Callable[[str], str]):
+        self.function = function
+
+    def apply(self, values: List[Optional[str]]) -> List[Optional[str]]:
+        masked = {}
+        for value in values:
+            if value is not None and value not in masked:
+                masked[value] = self.function(value)
+
+        return [masked[value] if value is not None else None for value in values]
+
+
+class TableMask:
+    sql: Dict[int, str]
+    python: Dict[int, PythonMask]
+
+    def __init__(self):
+        self.sql = {}
+        self.python = {}
+
+    def get_expression(self, column: Column) -> str:
+        if column.position in self.sql.keys():
+            return f'{self.sql[column.position]} AS {column.name}'
+
+        return column.name
+
+
+class Masking:
+    tables: Dict[str, TableMask]
+    dictionaries: Dict[str, List[str]]
+
+    def __init__(self, options: Options, schema: SchemaGenerator):
+        self.salt = options.mask_salt or ''
+        self.dictionaries = {name: self.load_dictionary(values)
+                             for name, values in options.mask_dictionaries.items()}
+        self.tables = {}
+
+        rules: Dict[Tuple[str, int], Tuple[MaskRule, Column]] = {}
+        for table_name, columns in options.masks.items():
+            table = schema.get_table(table_name)
+            if not table:
+                raise ValueError(f'cannot mask unknown table {table_name}')
+
+            for column_name, spec in columns.items():
+                column = next((column for column in table.columns
+                               if column.name == column_name), None)
+                if not column:
+                    raise ValueError(f'cannot mask unknown column {table_name}.{column_name}')
+
+                rules[(table.name, column.position)] = (MaskRule.parse(spec), column)
+
+        self.propagate(rules, schema)
+
+        for (table_name, position), (rule, source) in rules.items():
+            table = schema.get_table(table_name)
+            self.compile(table, table.get_column_at(position), rule, source)
+
+        for table_name, columns in options.column_policies.items():
+            table = schema.get_table(table_name)
+            if not table:
+                raise ValueError(f'cannot project unknown table {table_name}')
+
+            for column_name, spec in columns.items():
+                column = next((column for column in table.columns
+                               if column.name == column_name), None)
+                if not column:
+                    raise ValueError(f'cannot project unknown column {table_name}.{column_name}')
+
+                if (table.name, column.position) in rules.keys():
+                    raise ValueError(f'{table_name}.{column_name} has both a mask '
+                                     f'and a column policy')
+
+                self.compile_policy(table, column, ColumnPolicy.parse(spec))
+
+    @staticmethod
+    def load_dictionary(values: Union[str, List[Any]]) -> List[str]:
+        if isinstance(values, str):
+            values = Path(values).read_text(encoding='utf-8').splitlines()
+
+        values = [str(value) for value in values if str(value)]
+        if not values:
+            raise ValueError('masking dictionaries cannot be empty')
+
+        return values
+
+    @staticmethod
+    def propagate(rules: Dict[Tuple[str, int], Tuple[MaskRule, Column]],
+                  schema: SchemaGenerator) -> None:
+        changed = True
+        while changed:
+            changed = False
+            for table in schema.tables:
+                for relation in table.relations:
+                    if not relation.is_parent() or not relation.src or not relation.dest:
+                        continue
+
+                    parent = rules.get((relation.table_name, relation.dest))
+                    if parent and (table.name, relation.src) not in rules.keys():
+                        rules[(table.name, relation.src)] = parent
+                        changed = True
+
+    def get(self, table_name: str) -> Optional[TableMask]:
+        return self.tables.get(table_name)
+
+    def compile(self, table: Table, column: Column, rule: MaskRule, source: Column) -> None:
+        mask = self.tables.setdefault(table.name, TableMask())
+        text = TEXT_TYPE_RE.match(source.type)
+        name = f'{table.name}.{column.name}'
+
+        if rule.method != 'null' and not text and rule.method != 'hash':
+            raise ValueError(f'{rule.method} masking requires a text column, '
+                             f'{name} is {source.type}')
+
+        if rule.method == 'keep_format':
+            salt = self.salt
+            mask.python[column.position] = PythonMask(lambda value: keep_format(value, salt))
+
+            return
+
+        if rule.method == 'null':
+            if not column.is_null:
+                raise ValueError(f'{name} is NOT NULL and cannot be masked with null')
+
+            expression = 'NULL'
+        elif rule.method == 'truncate':
+            expression = f'left({column.name}, {rule.length})'
+        else:
+            expression = self.get_hash_expression(column, rule, source, text)
+
+        mask.sql[column.position] = f'({expression})::{column.type}'
+
+    def compile_policy(self, table: Table, column: Column, policy: ColumnPolicy) -> None:
+        mask = self.tables.setdefault(table.name, TableMask())
+        name = f'{table.name}.{column.name}'
+
+        if policy.policy == 'exclude':
+            if column.is_null:
+                expression = 'NULL'
+            elif column.default and 'nextval(' not in column.default:
+                expression = column.default
+            else:
+                raise ValueError(f'{name} is NOT NULL without a default and cannot be excluded')
+        elif policy.policy == 'truncate':
+            if TEXT_TYPE_RE.match(column.type):
+                expression = f'left({column.name}, {policy.length})'
+            elif column.type in BYTES_TYPES:
+                expression = f'substring({column.name} from 1 for {policy.length})'
+            else:
+                raise ValueError(f'truncate policy requires a text or bytea column, '
+                                 f'{name} is {column.type}')
+        else:
+            expression = f'CASE WHEN {column.name} IS NULL THEN NULL ' \
+                         f'ELSE {quote_literal(policy.value)} END'
+
+        mask.sql[column.position] = f'({expression})::{column.type}'
+
+    def get_hash_expression(self,
+                            column: Column,
+                            rule: MaskRule,
+                            source: Column,
+                            text: Optional[re.Match]) -> str:
+        digest = f'md5({quote_literal(self.salt)} || {column.name}::text)'
+
+        if rule.method == 'fake':
+            if rule.dictionary not in self.dictionaries.keys():
+                raise ValueError(f'unknown masking dictionary: {rule.dictionary}')
+
+            values = ', '.join([quote_literal(value)
+                                for value in self.dictionaries[rule.dictionary]])
+            bucket = f"(('x' || substr({digest}, 1, 8))::bit(32)::int & 2147483647)"
+
+            return f'(ARRAY[{values}])[1 + {bucket} % {len(self.dictionaries[rule.dictionary])}]'
+
+        if text:
+            return f'left({digest}, {text.group(3)})' if text.group(3) else digest
+
+        if source.type in HASH_INT_TYPES.keys():
+            digits, bits, suffix = HASH_INT_TYPES[source.type]
+
+            return f"(('x' || substr({digest}, 1, {digits}))::bit({bits})::" \
+                   f"{'bigint' if bits > 32 else 'int'}{suffix}"
+
+        if source.type == 'uuid':
+            return f'{digest}::uuid'
+
+        raise ValueError(f'hash masking does not support {source.type} '
+                         f'({column.name} of type {column.type})')
@@ -12,13 +12,50 @@ class Options:
         self.user = None
         self.password = None
         self.DBNAME = None
+        self.shards = []
         self.limit = None
         self.no_privileges = None
         self.no_publications = None
         self.no_subscriptions = None
+        self.bulk_introspection = None
+        self.no_schema_cache = None
+        self.clear_schema_cache = None
+        self.schema_cache_dir = None
+        self.split_sections = None
+        self.extraction = 'select'
+        self.copy_format = None
+        self.batch_size = None
+        self.key_memory_budget = None
+        self.key_propagation = None
+        self.jobs = 1
+        self.output_dir = None
+        self.compress = 6
+        self.target_dsn = None
+        self.stats = None
+        self.stats_file = None
+        self.dry_run = None
+        self.record = None
+        self.record_values = None
+        self.replay = None
+        self.serve = None
+        self.serve_allow = None
+        self.checkpoint = None
+        self.since_checkpoint = None
+        self.sampling = None
+        self.children = None
+        self.partitions = None
+        self.mask_salt = None
+        self.mask_dictionaries = {}
         self.dump_full = []
         self.custom_limits = {}
         self.custom_conditions = {}
+        self.watermark_columns = {}
+        self.table_sampling = {}
+        self.custom_children = {}
+        self.custom_partitions = {}
+        self.masks = {}
+        self.column_policies = {}
+        self.table_copy_formats = {}
 
     def make(self):
         self.parse_cli_args()
@@ -26,6 +63,15 @@ class Options:
         if self.find_config():
             self.parse_yaml(self.find_config())
 
+        self.apply_defaults()
+
+    def apply_defaults(self):
+        if not self.batch_size:
+            self.batch_size = 2000
+
+        if not self.key_memory_budget:
+            self.key_memory_budget = 512
+
     @staticmethod
     def find_config():
         if Path.cwd().joinpath('pg-slicer.yml').exists():
@@ -58,25 +104,85 @@ class Options:
                             and connection['password'] != '~':
                         self.password = connection['password']
 
+                if not self.shards and 'shards' in config:
+                    self.shards = config['shards'] or []
+
                 if 'dump' in config:
                     dump_config = config['dump']
 
                     if not self.limit and 'limit' in dump_config:
                         self.limit = dump_config['limit']
 
+                    if not self.split_sections and 'split_sections' in dump_config:
+                        self.split_sections = dump_config['split_sections']
+
+                    if not self.batch_size and 'batch_size' in dump_config:
+                        self.batch_size = dump_config['batch_size']
+
+                    if not self.key_memory_budget and 'key_memory_budget' in dump_config:
+                        self.key_memory_budget = dump_config['key_memory_budget']
+
+                    if not self.key_propagation and 'key_propagation' in dump_config:
+                        self.key_propagation = dump_config['key_propagation']
+
+                    if not self.copy_format and 'copy_format' in dump_config:
+                        self.copy_format = dump_config['copy_format']
+
+                    if not self.sampling and 'sampling' in dump_config:
+                        self.sampling = dump_config['sampling']
+
+                    if not self.children and 'children' in dump_config:
+                        self.children = dump_config['children']
+
+                    if not self.partitions and 'partitions' in dump_config:
+                        self.partitions = dump_config['partitions']
+
+                    if 'masking' in dump_config:
+                        masking = dump_config['masking'] or {}
+
+                        if not self.mask_salt and 'salt' in masking:
+                            self.mask_salt = str(masking['salt'])
+
+                        if 'dictionaries' in masking:
+                            self.mask_dictionaries = masking['dictionaries']
+
                     if 'tables' in dump_config:
                         for table_name, table_config in dump_config['tables'].items():
-                            if 'limit' in table_config:
-                                if table_config['limit'] == '*':
-                                    self.dump_full.append(table_name)
-                                else:
-                                    self.custom_limits[table_name] = table_config['limit']
-
-                            if 'condition' in table_config:
-                                self.custom_conditions[table_name] = table_config['condition']
+                            self.parse_table_config(table_name, table_config)
             except yaml.YAMLError:
                 return
 
+    def parse_table_config(self, table_name: str, table_config: dict):
+        if 'limit' in table_config:
+            if table_config['limit'] == '*':
+                self.dump_full.append(table_name)
+            else:
+                self.custom_limits[table_name] = table_config['limit']
+
+        if 'condition' in table_config:
+            self.custom_conditions[table_name] = table_config['condition']
+
+        if 'watermark' in table_config:
+            self.watermark_columns[table_name] = table_config['watermark']
+
+        if 'sampling' in table_config:
+            self.table_sampling[table_name] = table_config['sampling']
+
+        if 'children' in table_config:
+            self.custom_children[table_name] = table_config['children']
+
+        if 'partitions' in table_config:
+            self.custom_partitions[table_name] = table_config['partitions']
+
+        if 'copy_format' in table_config:
+            self.table_copy_formats[table_name] = table_config['copy_format']
+
+        if 'mask' in table_config:
+            self.masks[table_name] = table_config['mask']
+
+        if 'columns' in table_config:
+            self.column_policies[table_name] = table_config['columns']
+
     def parse_cli_args(self):
         parser = argparse.ArgumentParser(description="PostgreSQL DB data slicer", add_help=False)
         parser.add_argument('-h', '--host', dest='host', default=getenv('PGHOST'))
@@ -84,10 +190,45 @@ class Options:
         parser.add_argument('-U', '--user', dest='user', default=getenv('PGUSER'))
         parser.add_argument('-W', '--password', dest='password')
         parser.add_argument('-l', '--limit', type=int, dest='limit', default=100)
+        parser.add_argument('--shard', action='append', dest='shards')
         parser.add_argument('--dump-full', action='append', dest='dump_full')
         parser.add_argument('--no-privileges', action='store_true', dest='no_privileges')
         parser.add_argument('--no-publications', action='store_true', dest='no_publications')
         parser.add_argument('--no-subscriptions', action='store_true', dest='no_subscriptions')
+        parser.add_argument('--bulk-introspection', action='store_true',
+                            dest='bulk_introspection')
+        parser.add_argument('--no-schema-cache', action='store_true', dest='no_schema_cache')
+        parser.add_argument('--clear-schema-cache', action='store_true',
+                            dest='clear_schema_cache')
+        parser.add_argument('--schema-cache-dir', dest='schema_cache_dir')
+        parser.add_argument('--split-sections', action='store_true', dest='split_sections')
+        parser.add_argument('--extraction', choices=['select', 'copy'], dest='extraction')
+        parser.add_argument('--copy-format', choices=['text', 'binary'], dest='copy_format')
+        parser.add_argument('--batch-size', type=int, dest='batch_size')
+        parser.add_argument('--key-memory-budget', type=int, dest='key_memory_budget')
+        parser.add_argument('--key-propagation', choices=['inline', 'array', 'temp-table'],
+                            dest='key_propagation')
+        parser.add_argument('-j', '--jobs', type=int, dest='jobs')
+        parser.add_argument('--output-dir', dest='output_dir')
+        parser.add_argument('-Z', '--compress', type=int, choices=range(0, 10), dest='compress')
+        parser.add_argument('--target-dsn', dest='target_dsn')
+        parser.add_argument('--stats', action='store_true', dest='stats')
+        parser.add_argument('--stats-file', dest='stats_file')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run')
+        record_group = parser.add_mutually_exclusive_group()
+        record_group.add_argument('--record', dest='record')
+        record_group.add_argument('--replay', dest='replay')
+        parser.add_argument('--record-values', choices=['full', 'masked'], dest='record_values')
+        parser.add_argument('--serve', dest='serve')
+        parser.add_argument('--serve-allow', action='append', choices=['output', 'conditions'],
+                            dest='serve_allow')
+        parser.add_argument('--sampling', dest='sampling')
+        parser.add_argument('--children', type=int, dest='children')
+        parser.add_argument('--partitions', type=int, dest='partitions')
+        parser.add_argument('--mask-salt', dest='mask_salt')
+        checkpoint_group = parser.add_mutually_exclusive_group()
+        checkpoint_group.add_argument('--checkpoint', dest='checkpoint')
+        checkpoint_group.add_argument('--since-checkpoint', dest='since_checkpoint')
         parser.add_argument('--help', action='help')
         parser.add_argument('DBNAME', default=getenv('PGDATABASE'))
 
@@ -0,0 +1,389 @@
+import gzip
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import IO, BinaryIO, Callable, Dict, List, Optional, TextIO, Tuple
+
+import psycopg2
+from psycopg2.extensions import connection as _connection
+
+MERGE_TABLE = 'pg_slicer_merge'
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + bytes(8)
+BINARY_TRAILER = b'\xff\xff'
+
+
+def get_merge_statements(table_name: str, columns: List[str], keys: List[str]) \
+        -> Tuple[str, str]:
+    prepare = f'CREATE TEMP TABLE {MERGE_TABLE} (LIKE {table_name})'
+    finish = f'INSERT INTO {table_name} SELECT * FROM {MERGE_TABLE}'
+
+    if keys:
+        updates = ', '.join([f'{column} = EXCLUDED.{column}'
+                             for column in columns if column not in keys])
+        finish += f' ON CONFLICT ({", ".join(keys)}) DO '
+        finish += f'UPDATE SET {updates}' if updates else 'NOTHING'
+
+    return prepare, f'{finish}; DROP TABLE {MERGE_TABLE}'
+
+
+class StreamOutput:
+    ordered = True
+    copy_framing = True
+    copy_extraction = False
+    binary = False
+    SPOOL_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write_pre_data(self, sql: str) -> None:
+        self.stream.write(sql + '\n')
+
+    def write_post_data(self, sql: str, statements: List[str] = None) -> None:
+        if sql:
+            self.stream.write(sql + '\n')
+
+    def open_table(self,
+                   table_name: str,
+                   layer: int,
+                   spool: bool = False,
+                   merge: Tuple[str, str] = None,
+                   binary: bool = False) -> IO:
+        if spool:
+            return tempfile.SpooledTemporaryFile(max_size=self.SPOOL_SIZE, mode='w+')
+
+        return self.stream
+
+    def close_table(self,
+                    table_name: str,
+                    stream: TextIO,
+                    rows: int,
+                    committed: Callable[[], None] = None) -> None:
+        if stream is not self.stream:
+            with self.lock:
+                stream.seek(0)
+                shutil.copyfileobj(stream, self.stream)
+
+            stream.close()
+
+        if committed:
+            committed()
+
+    def discard_table(self, table_name: str, stream: TextIO) -> None:
+        if stream is not self.stream:
+            stream.close()
+
+    def restore_table(self, table_name: str, layer: int, rows: int, binary: bool = False) \
+            -> None:
+        pass
+
+    def close(self) -> None:
+        self.stream.flush()
+
+
+class DirectoryOutput:
+    ordered = False
+    copy_framing = True
+    copy_extraction = False
+    binary = True
+    FORMAT_VERSION = 2
+    PRE_DATA_FILE = 'pre-data.sql'
+    POST_DATA_FILE = 'post-data.sql'
+    MANIFEST_FILE = 'manifest.json'
+
+    tables: List[Dict]
+
+    def __init__(self, path: str, compress_level: int = 6):
+        self.path = Path(path)
+        self.compress_level = compress_level
+        self.tables = []
+        self.post_data_statements = []
+        self.lock = threading.Lock()
+
+        self.path.joinpath('data').mkdir(parents=True, exist_ok=True)
+
+    def write_pre_data(self, sql: str) -> None:
+        self.path.joinpath(self.PRE_DATA_FILE).write_text(sql + '\n')
+
+    def write_post_data(self, sql: str, statements: List[str] = None) -> None:
+        self.path.joinpath(self.POST_DATA_FILE).write_text(sql + '\n' if sql else '')
+        self.post_data_statements = statements or []
+
+    def add_table(self, table_name: str, layer: int, rows: int = None, binary: bool = False) \
+            -> str:
+        with self.lock:
+            base_name = 'data/' + re.sub(r'[^A-Za-z0-9_.-]', '_', table_name)
+            file_names = [table['file'] for table in self.tables]
+            file_name = base_name + self.get_suffix(binary)
+            counter = 1
+            while file_name in file_names:
+                counter += 1
+                file_name = f'{base_name}-{counter}{self.get_suffix(binary)}'
+
+            self.tables.append({'table': table_name, 'layer': layer, 'file': file_name,
+                                'format': 'binary' if binary else 'text', 'rows': rows})
+
+        return file_name
+
+    def get_suffix(self, binary: bool = False) -> str:
+        suffix = '.bin' if binary else '.sql'
+
+        return suffix + '.gz' if self.compress_level else suffix
+
+    def open_table(self,
+                   table_name: str,
+                   layer: int,
+                   spool: bool = False,
+                   merge: Tuple[str, str] = None,
+                   binary: bool = False) -> IO:
+        file_name = self.add_table(table_name, layer, binary=binary)
+
+        if self.compress_level and binary:
+            return gzip.open(self.path.joinpath(file_name), 'wb',
+                             compresslevel=self.compress_level)
+
+        if self.compress_level:
+            return gzip.open(self.path.joinpath(file_name), 'wt', encoding='utf-8',
+                             compresslevel=self.compress_level)
+
+        if binary:
+            return open(self.path.joinpath(file_name), 'wb')
+
+        return open(self.path.joinpath(file_name), 'w', encoding='utf-8')
+
+    def close_table(self,
+                    table_name: str,
+                    stream: TextIO,
+                    rows: int,
+                    committed: Callable[[], None] = None) -> None:
+        stream.close()
+
+        with self.lock:
+            for table in self.tables:
+                if table['table'] == table_name and table['rows'] is None:
+                    table['rows'] = rows
+
+                    break
+
+        if committed:
+            committed()
+
+    def discard_table(self, table_name: str, stream: TextIO) -> None:
+        stream.close()
+
+    def restore_table(self, table_name: str, layer: int, rows: int, binary: bool = False) \
+            -> None:
+        self.add_table(table_name, layer, rows, binary)
+
+    def close(self) -> None:
+        manifest = {
+            'format': 'pg-slicer-directory',
+            'version': self.FORMAT_VERSION,
+            'compression': 'gzip' if self.compress_level else None,
+            'pre_data': self.PRE_DATA_FILE,
+            'post_data': self.POST_DATA_FILE,
+            'post_data_statements': self.post_data_statements,
+            'tables': sorted(self.tables, key=lambda table: (table['layer'], table['table'])),
+        }
+
+        with open(self.path.joinpath(self.MANIFEST_FILE), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+
+class PipeReader:
+    def __init__(self, pipe: BinaryIO):
+        self.pipe = pipe
+        self.aborted = threading.Event()
+        self.committed: Optional[Callable[[], None]] = None
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.pipe.read(size)
+        if self.aborted.is_set():
+            raise IOError('table extraction aborted')
+
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        data = self.pipe.readline(size)
+        if self.aborted.is_set():
+            raise IOError('table extraction aborted')
+
+        return data
+
+    def close(self) -> None:
+        self.pipe.close()
+
+
+class TargetOutput:
+    ordered = False
+    copy_framing = False
+    copy_extraction = True
+    binary = True
+
+    loads: List[threading.Thread]
+    readers: Dict[int, PipeReader]
+    errors: List[BaseException]
+
+    def __init__(self, dsn: str, jobs: int = 1):
+        self.dsn = dsn
+        self.jobs = max(1, jobs)
+        self.idle = queue.Queue()
+        self.connections = []
+        self.loads = []
+        self.readers = {}
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def get_connection(self) -> _connection:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            connection = psycopg2.connect(self.dsn)
+            connection.autocommit = True
+            connection.set_client_encoding('UTF8')
+
+            with self.lock:
+                self.connections.append(connection)
+
+            return connection
+
+    def execute(self, sql: str) -> None:
+        connection = self.get_connection()
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+        finally:
+            self.idle.put(connection)
+
+    def write_pre_data(self, sql: str) -> None:
+        self.execute(sql)
+
+    def write_post_data(self, sql: str, statements: List[str] = None) -> None:
+        if statements:
+            self.execute_parallel(statements)
+        elif sql.strip():
+            self.execute(sql)
+
+    def execute_parallel(self, statements: List[str]) -> None:
+        pending = queue.Queue()
+        for statement in statements:
+            pending.put(statement)
+
+        def run() -> None:
+            while True:
+                try:
+                    statement = pending.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    self.execute(statement)
+                except BaseException as error:
+                    with self.lock:
+                        self.errors.append(error)
+
+        threads = [threading.Thread(target=run, name=f'pg-slicer-post-data-{number}', daemon=True)
+                   for number in range(min(self.jobs, len(statements)))]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.raise_errors()
+
+    def load(self,
+             table_name: str,
+             reader: PipeReader,
+             merge: Tuple[str, str] = None,
+             binary: bool = False) -> None:
+        connection = self.get_connection()
+        copy_format = ' (FORMAT binary)' if binary else ''
+
+        try:
+            with connection.cursor() as cursor:
+                if merge:
+                    cursor.execute(merge[0])
+                    cursor.copy_expert(f'COPY {MERGE_TABLE} FROM STDIN{copy_format}', reader)
+                    cursor.execute(merge[1])
+                else:
+                    cursor.copy_expert(f'COPY {table_name} FROM STDIN{copy_format}', reader)
+
+            if reader.committed:
+                reader.committed()
+        except BaseException as error:
+            if not reader.aborted.is_set():
+                with self.lock:
+                    self.errors.append(error)
+
+            reader.pipe.read()
+        finally:
+            reader.close()
+            self.idle.put(connection)
+
+    def open_table(self,
+                   table_name: str,
+                   layer: int,
+                   spool: bool = False,
+                   merge: Tuple[str, str] = None,
+                   binary: bool = False) -> IO:
+        read_fd, write_fd = os.pipe()
+        reader = PipeReader(os.fdopen(read_fd, 'rb'))
+        stream = os.fdopen(write_fd, 'wb') if binary \
+            else os.fdopen(write_fd, 'w', encoding='utf-8')
+
+        thread = threading.Thread(target=self.load, args=(table_name, reader, merge, binary),
+                                  name=f'pg-slicer-load-{table_name}', daemon=True)
+        thread.start()
+
+        with self.lock:
+            self.loads.append(thread)
+            self.readers[id(stream)] = reader
+
+        return stream
+
+    def close_table(self,
+                    table_name: str,
+                    stream: TextIO,
+                    rows: int,
+                    committed: Callable[[], None] = None) -> None:
+        with self.lock:
+            reader = self.readers.pop(id(stream))
+
+        reader.committed = committed
+        stream.close()
+        self.raise_errors()
+
+    def discard_table(self, table_name: str, stream: TextIO) -> None:
+        with self.lock:
+            reader: Optional[PipeReader] = self.readers.pop(id(stream), None)
+
+        if reader:
+            reader.aborted.set()
+
+        stream.close()
+
+    def restore_table(self, table_name: str, layer: int, rows: int, binary: bool = False) \
+            -> None:
+        pass
+
+    def raise_errors(self) -> None:
+        with self.lock:
+            if self.errors:
+                raise self.errors[0]
+
+    def close(self) -> None:
+        for thread in self.loads:
+            thread.join()
+
+        for connection in self.connections:
+            connection.close()
+
+        self.raise_errors()
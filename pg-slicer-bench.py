@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import argparse
+import itertools
+import sys
+
+from benchmark import Benchmark, LocalCluster, SyntheticSchema
+
+
+def int_list(value: str) -> list:
+    return [int(item) for item in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pg-slicer benchmark suite')
+    parser.add_argument('--dsn', dest='dsn',
+                        help='maintenance connection of a throwaway server, '
+                             'a local cluster is started with initdb when omitted')
+    parser.add_argument('--pg-bin', dest='pg_bin', help='directory with initdb and pg_ctl')
+    parser.add_argument('--tables', type=int_list, default=[10, 100, 1000])
+    parser.add_argument('--fanout', type=int_list, default=[2])
+    parser.add_argument('--depth', type=int_list, default=[3])
+    parser.add_argument('--width', type=int_list, default=[8])
+    parser.add_argument('--rows', type=int_list, default=[1000])
+    parser.add_argument('--limit', type=int_list, default=[100])
+    parser.add_argument('--extraction', type=lambda value: value.split(','),
+                        default=['select', 'copy'])
+    parser.add_argument('--bulk-introspection', type=lambda value: value.split(','),
+                        default=['off', 'on'], dest='bulk_introspection')
+    parser.add_argument('-o', '--output', default='bench_output.json')
+    parser.add_argument('--compare', help='previous result file to compare against')
+    args = parser.parse_args()
+
+    schemas = [SyntheticSchema(tables, fanout, depth, width, rows)
+               for tables, fanout, depth, width, rows
+               in itertools.product(args.tables, args.fanout, args.depth, args.width, args.rows)]
+    variants = [{'limit': limit, 'extraction': extraction, 'bulk_introspection': bulk == 'on'}
+                for limit, extraction, bulk
+                in itertools.product(args.limit, args.extraction, args.bulk_introspection)]
+
+    cluster = None
+    dsn = args.dsn
+    if not dsn:
+        cluster = LocalCluster(args.pg_bin)
+        dsn = cluster.start()
+
+    try:
+        benchmark = Benchmark(dsn, schemas, variants)
+        results = benchmark.run(lambda line: print(line, file=sys.stderr))
+        benchmark.save(args.output)
+
+        if args.compare:
+            for line in Benchmark.compare(args.compare, results):
+                print(line)
+    finally:
+        if cluster:
+            cluster.stop()
+
+
+if __name__ == '__main__':
+    main()
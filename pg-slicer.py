@@ -1,9 +1,23 @@
 #!/usr/bin/env python3
+import sys
+from typing import Callable
 
 import psycopg2
+from psycopg2.extensions import connection as _connection
+from checkpoint import Checkpoint
 from data_generator import DataGenerator
+from masking import Masking
 from options import Options
+from output import DirectoryOutput, StreamOutput, TargetOutput
+from planner import Planner
+from recording import Player, Recorder
+from sampling import Sampling
+from schema_cache import SchemaCache
 from schema_generator import SchemaGenerator
+from service import SliceService
+from sharding import Shard, ShardSet
+from stats import Stats
+from worker_pool import WorkerPool
 
 
 def build_dsn(options: Options) -> str:
@@ -26,18 +40,145 @@ def build_dsn(options: Options) -> str:
     return ' '.join([f'{key}={value}' for key, value in params.items()])
 
 
+def check_config(options: Options, schema_generator: SchemaGenerator = None) -> None:
+    try:
+        sampling = Sampling.parse(options.sampling)
+        for spec in options.table_sampling.values():
+            Sampling.parse(spec, sampling.seed)
+
+        for spec in options.shards:
+            Shard.parse(spec)
+
+        if schema_generator:
+            Masking(options, schema_generator)
+    except (OSError, ValueError) as error:
+        sys.exit(str(error))
+
+
 def main():
     options = Options()
-    options.make()
+    try:
+        options.make()
+    except ValueError as error:
+        sys.exit(str(error))
+
+    check_config(options)
     dsn = build_dsn(options)
-    connection = psycopg2.connect(dsn)
+
+    connect = psycopg2.connect
+    recorder = None
+    if options.replay:
+        try:
+            connect = Player(options.replay).connect
+        except ValueError as error:
+            sys.exit(str(error))
+
+        options.no_schema_cache = True
+    elif options.record:
+        if options.record_values == 'masked' and (options.copy_format == 'binary' or
+                                                  'binary' in options.table_copy_formats.values()):
+            sys.exit('masked recordings do not support --copy-format binary')
+
+        if options.record_values == 'masked' and options.dry_run:
+            sys.exit('masked recordings do not support --dry-run')
+
+        if options.record_values == 'masked' and \
+                any([Sampling.parse(spec).method == 'random-key'
+                     for spec in [options.sampling, *options.table_sampling.values()]]):
+            sys.exit('masked recordings do not support random-key sampling')
+
+        recorder = Recorder(options.record, options.record_values or 'full')
+        connect = recorder.connect
+        options.no_schema_cache = True
+
+    try:
+        if options.serve:
+            service = SliceService(dsn, options, connect)
+            check_config(options, service.schema)
+            service.serve()
+        else:
+            run(options, dsn, connect)
+    finally:
+        if recorder:
+            recorder.close()
+
+
+def run(options: Options, dsn: str, connect: Callable[[str], _connection]):
+    connection = connect(dsn)
     connection.autocommit = True
     cursor = connection.cursor()
-    schema_generator = SchemaGenerator(cursor)
-    schema = schema_generator.generate_schema()
-    print(schema)
-    data_generator = DataGenerator(cursor, schema_generator, options)
-    data_generator.generate_data()
+    stats = Stats(bool(options.stats or options.stats_file))
+
+    with stats.phase(None, 'introspection'):
+        schema_generator = SchemaGenerator(stats.wrap_cursor(cursor), options)
+        schema = SchemaCache(stats.wrap_cursor(cursor), options).generate_schema(schema_generator)
+
+    check_config(options, schema_generator)
+
+    if options.dry_run:
+        Planner(cursor, schema_generator, options).write_report(sys.stdout)
+
+        return
+
+    if options.shards and (options.checkpoint or options.since_checkpoint):
+        sys.exit('checkpoints cannot be used with --shard')
+
+    if options.target_dsn:
+        output = TargetOutput(options.target_dsn, options.jobs)
+    elif options.output_dir:
+        output = DirectoryOutput(options.output_dir, options.compress)
+    else:
+        output = StreamOutput(sys.stdout)
+
+    checkpoint = None
+    if options.since_checkpoint:
+        checkpoint = Checkpoint(options.since_checkpoint)
+        if checkpoint.get_state(options.DBNAME) != Checkpoint.COMPLETE:
+            sys.exit(f'{options.since_checkpoint}: no complete checkpoint of {options.DBNAME}')
+
+        checkpoint.begin()
+    elif options.checkpoint:
+        checkpoint = Checkpoint(options.checkpoint)
+        if checkpoint.get_state(options.DBNAME) != Checkpoint.RUNNING:
+            checkpoint.start(options.DBNAME)
+
+    if not checkpoint or not checkpoint.tables:
+        output.write_pre_data(schema)
+
+    pool = None
+    if options.jobs > 1 and not options.shards:
+        pool = WorkerPool(connection, dsn, options.jobs, connect)
+        pool.start()
+
+    try:
+        if options.shards:
+            ShardSet(dsn, options, connect).generate_data(schema_generator, output, stats)
+        else:
+            data_generator = DataGenerator(cursor, schema_generator, options, output, pool, stats,
+                                           checkpoint)
+            data_generator.generate_data()
+
+        post_data = []
+        if options.split_sections:
+            post_data = schema_generator.post_data + schema_generator.generate_sequence_values()
+
+        output.write_post_data('\n'.join(post_data), post_data)
+        output.close()
+
+        if checkpoint:
+            checkpoint.finish()
+
+        if options.stats:
+            stats.write_summary(sys.stderr)
+
+        if options.stats_file:
+            stats.write_json(options.stats_file)
+    finally:
+        if pool:
+            pool.close()
+
+        if checkpoint:
+            checkpoint.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,225 @@
+import json
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+from psycopg2.extensions import cursor as _cursor
+
+from data_generator import DataGenerator
+from dependency_graph import DependencyGraph
+from key_store import KeySet
+from options import Options
+from schema_generator import Column, Relation, SchemaGenerator, Table
+
+
+class TablePlan:
+    def __init__(self, name: str, layer: int):
+        self.name = name
+        self.layer = layer
+        self.query = ''
+        self.rows = 0
+        self.width = 0
+        self.keys = 0
+        self.scans: List[str] = []
+        self.warnings: List[str] = []
+
+    def get_bytes(self) -> int:
+        return self.rows * self.width
+
+
+class Planner:
+    EXPLAIN_KEYS = 1000
+    SEQ_SCAN_ROWS = 100000
+    MAX_KEYS = 10000
+
+    cursor: _cursor
+    schema: SchemaGenerator
+    options: Options
+    plans: Dict[str, TablePlan]
+
+    def __init__(self, cursor: _cursor, schema: SchemaGenerator, options: Options):
+        self.cursor = cursor
+        self.schema = schema
+        self.options = options
+        self.generator = DataGenerator(cursor, schema, options)
+        self.plans = {}
+
+    def plan(self) -> List[TablePlan]:
+        layers = DependencyGraph(self.schema.get_data_tables(), required_only=True).get_layers()
+
+        try:
+            for layer, components in enumerate(layers):
+                for component in components:
+                    for table_name in component:
+                        plan = self.plan_table(self.schema.get_table(table_name), layer)
+                        self.plans[table_name] = plan
+                        self.generator.row_counts[table_name] = plan.rows
+        finally:
+            self.generator.key_store.close()
+
+        return list(self.plans.values())
+
+    def plan_table(self, table: Table, layer: int) -> TablePlan:
+        plan = TablePlan(table.name, layer)
+        conditions = []
+        parents = []
+
+        for relation in table.relations:
+            if relation.is_child() or relation.table_name not in self.plans.keys():
+                continue
+
+            column = table.get_column_at(relation.src) if relation.src else None
+            if not column or column.is_null or not relation.dest:
+                continue
+
+            keys = self.get_key_count(relation.table_name, relation.dest)
+            if not keys:
+                continue
+
+            key_set = self.get_sample_keys(table, column, relation,
+                                           min(keys, self.EXPLAIN_KEYS))
+            if key_set is None:
+                plan.warnings.append(f'no statistics for {column.name}')
+                continue
+
+            self.generator.key_store.put(key_set)
+            plan.keys += keys
+            parents.append(relation)
+            conditions.append(f'({self.generator.prepare_condition(table, relation)})')
+
+        where = ' OR '.join(conditions) if conditions else '1=1'
+        if table.name in self.options.custom_conditions.keys():
+            where, parents = self.options.custom_conditions[table.name], []
+
+        limit = self.generator.get_limit(table)
+        if limit == 'ALL':
+            parents = []
+
+        children = self.generator.get_children(table, parents)
+        plan.query = self.generator.get_query(table, where, None, parents,
+                                              self.generator.get_projection(table), children,
+                                              limit, self.cursor)
+        rows, plan.width, plan.scans, seq_scans = self.explain(plan.query)
+
+        sampled = min(plan.keys, self.EXPLAIN_KEYS)
+        if sampled and plan.keys > sampled:
+            rows = rows * plan.keys // sampled
+
+        if children:
+            rows = min(rows, plan.keys * children)
+        elif limit != 'ALL':
+            rows = min(rows, limit)
+
+        plan.rows = rows
+
+        for relation_name, relation_rows in seq_scans:
+            if relation_rows >= self.SEQ_SCAN_ROWS:
+                plan.warnings.append(f'seq scan over {relation_rows} rows of {relation_name}')
+
+        if plan.keys > self.MAX_KEYS:
+            plan.warnings.append(f'IN list of {plan.keys} keys')
+
+        return plan
+
+    def get_key_count(self, table_name: str, position: int) -> int:
+        rows = self.plans[table_name].rows
+        table = self.schema.get_table(table_name)
+        column = table.get_column_at(position)
+        if not column:
+            return rows
+
+        distinct = self.get_distinct(table, column)
+
+        return min(rows, distinct) if distinct else rows
+
+    def get_stats(self, table: Table, column: Column) -> Optional[Tuple[Any, ...]]:
+        self.cursor.execute('SELECT s.n_distinct, s.most_common_vals::text::text[], '
+                            's.histogram_bounds::text::text[], c.reltuples '
+                            'FROM pg_catalog.pg_stats s '
+                            'JOIN pg_catalog.pg_class c ON c.relname = s.tablename '
+                            'AND c.relnamespace = pg_catalog.to_regnamespace(s.schemaname) '
+                            'WHERE s.tablename = %s AND s.attname = %s '
+                            'AND s.schemaname = ANY(pg_catalog.current_schemas(false))',
+                            (table.name, column.name))
+
+        return self.cursor.fetchone()
+
+    def get_distinct(self, table: Table, column: Column) -> Optional[int]:
+        stats = self.get_stats(table, column)
+        if not stats or stats[0] is None:
+            return None
+
+        if stats[0] < 0:
+            return max(1, int(-stats[0] * max(stats[3], 0)))
+
+        return int(stats[0])
+
+    def get_sample_keys(self,
+                        table: Table,
+                        column: Column,
+                        relation: Relation,
+                        count: int) -> Optional[KeySet]:
+        stats = self.get_stats(table, column)
+        if not stats:
+            return None
+
+        values = list(dict.fromkeys((stats[1] or []) + (stats[2] or [])))
+        if not values:
+            return None
+
+        step = max(1, len(values) // count)
+        key_set = KeySet(relation.table_name, relation.dest, column.type)
+        for value in values[::step][:count]:
+            key_set.add(value)
+
+        return key_set
+
+    def explain(self, query: str) -> Tuple[int, int, List[str], List[Tuple[str, int]]]:
+        self.cursor.execute(f'EXPLAIN (FORMAT JSON) {query}')
+        root = self.cursor.fetchone()[0]
+        root = (json.loads(root) if isinstance(root, str) else root)[0]['Plan']
+
+        rows = root['Plan Rows']
+        if root['Node Type'] == 'Limit' and root.get('Plans'):
+            rows = root['Plans'][0]['Plan Rows']
+
+        scans = []
+        seq_scans = []
+        nodes = [root]
+        while nodes:
+            node = nodes.pop()
+            nodes += node.get('Plans', [])
+            if 'Relation Name' not in node:
+                continue
+
+            scans.append(node['Node Type'])
+            if node['Node Type'] == 'Seq Scan':
+                seq_scans.append((node['Relation Name'], self.get_reltuples(node)))
+
+        return int(rows), root['Plan Width'], scans, seq_scans
+
+    def get_reltuples(self, node: Dict[str, Any]) -> int:
+        schema = f'{node["Schema"]}.' if node.get('Schema') else ''
+        self.cursor.execute('SELECT reltuples FROM pg_catalog.pg_class '
+                            'WHERE oid = %s::pg_catalog.regclass',
+                            (schema + node['Relation Name'],))
+        row = self.cursor.fetchone()
+
+        return max(0, int(row[0])) if row else 0
+
+    def write_report(self, stream: TextIO) -> None:
+        plans = self.plan()
+        scans = {plan.name: ','.join(sorted(set(plan.scans))) for plan in plans}
+        width = max([len('table')] + [len(plan.name) for plan in plans])
+        scan_width = max([len('scan')] + [len(scan) for scan in scans.values()])
+        stream.write(f'{"layer":>5} {"table".ljust(width)} '
+                     + ' '.join([f'{column:>13}' for column in ['rows', 'bytes', 'keys']])
+                     + f'  {"scan".ljust(scan_width)}  warnings\n')
+
+        for plan in plans:
+            columns = [str(plan.rows), str(plan.get_bytes()), str(plan.keys)]
+            stream.write(f'{plan.layer:>5} {plan.name.ljust(width)} '
+                         + ' '.join([f'{column:>13}' for column in columns])
+                         + f'  {scans[plan.name].ljust(scan_width)}  {"; ".join(plan.warnings)}'
+                         .rstrip() + '\n')
+
+        stream.write(f'total {sum([plan.rows for plan in plans])} rows, '
+                     f'{sum([plan.get_bytes() for plan in plans])} bytes\n')
@@ -0,0 +1,420 @@
+import base64
+import datetime
+import decimal
+import gzip
+import io
+import itertools
+import json
+import re
+import secrets
+import threading
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, IO, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extras
+from psycopg2.extensions import connection as _connection, cursor as _cursor
+
+from data_generator import decode_copy_value
+from masking import keep_format
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|pg_slicer_keys_\d+")
+LIST_RE = re.compile(r'\?(?:\s*,\s*\?)*')
+SPACE_RE = re.compile(r'\s+')
+CATALOG_RE = re.compile(r'\bpg_catalog\.')
+COPY_TO_RE = re.compile(r'\bTO\s+STDOUT\b(\s*\([^)]*\))?\s*$', re.IGNORECASE)
+VALUE_MODES = ['full', 'masked']
+FORMAT = 'pg-slicer-recording'
+VERSION = 1
+RANGE_TYPES = ['NumericRange', 'DateRange', 'DateTimeRange', 'DateTimeTZRange']
+
+
+def get_query_key(query: str) -> str:
+    return SPACE_RE.sub(' ', LIST_RE.sub('?', LITERAL_RE.sub('?', query))).strip()
+
+
+def encode_value(value: Any) -> Any:
+    if value is None or type(value) in [bool, int, float, str]:
+        return value
+
+    if isinstance(value, (bytes, memoryview)):
+        return {'$': 'bytes', 'v': base64.b64encode(bytes(value)).decode('ascii')}
+
+    if isinstance(value, (list, tuple)):
+        return {'$': 'list', 'v': [encode_value(item) for item in value]}
+
+    if isinstance(value, dict):
+        return {'$': 'json', 'v': value}
+
+    if isinstance(value, decimal.Decimal):
+        return {'$': 'decimal', 'v': str(value)}
+
+    if isinstance(value, datetime.datetime):
+        return {'$': 'datetime', 'v': value.isoformat()}
+
+    if isinstance(value, datetime.date):
+        return {'$': 'date', 'v': value.isoformat()}
+
+    if isinstance(value, datetime.time):
+        return {'$': 'time', 'v': value.isoformat()}
+
+    if isinstance(value, datetime.timedelta):
+        return {'$': 'interval', 'v': [value.days, value.seconds, value.microseconds]}
+
+    if type(value).__name__ in RANGE_TYPES:
+        return {'$': 'range', 't': type(value).__name__,
+                'v': [encode_value(value.lower), encode_value(value.upper),
+                      ('[' if value.lower_inc else '(') + (']' if value.upper_inc else ')'),
+                      value.isempty]}
+
+    return {'$': 'str', 'v': str(value)}
+
+
+def decode_value(value: Any) -> Any:
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+
+    if not isinstance(value, dict):
+        return value
+
+    kind, data = value.get('$'), value.get('v')
+    if kind == 'bytes':
+        return base64.b64decode(data)
+
+    if kind == 'list':
+        return decode_value(data)
+
+    if kind == 'decimal':
+        return decimal.Decimal(data)
+
+    if kind == 'datetime':
+        return datetime.datetime.fromisoformat(data)
+
+    if kind == 'date':
+        return datetime.date.fromisoformat(data)
+
+    if kind == 'time':
+        return datetime.time.fromisoformat(data)
+
+    if kind == 'interval':
+        return datetime.timedelta(*data)
+
+    if kind == 'range' and value.get('t') in RANGE_TYPES:
+        range_type = getattr(psycopg2.extras, value['t'])
+
+        return range_type(empty=True) if data[3] \
+            else range_type(decode_value(data[0]), decode_value(data[1]), data[2])
+
+    if kind in ['json', 'str']:
+        return data
+
+    raise ValueError(f'unknown recorded value: {kind}')
+
+
+def encode_rows(rows: Optional[List[tuple]]) -> Optional[List[list]]:
+    return None if rows is None else [[encode_value(value) for value in row] for row in rows]
+
+
+def decode_rows(rows: Optional[List[list]]) -> Optional[List[tuple]]:
+    return None if rows is None else [tuple([decode_value(value) for value in row])
+                                      for row in rows]
+
+
+def encode_field(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r') \
+        .replace('\t', '\\t')
+
+
+class Scrambler:
+    def __init__(self):
+        self.salt = secrets.token_hex(16)
+
+    def scramble(self, value: Any) -> Any:
+        if value is None or type(value) is bool:
+            return value
+
+        if type(value) is int:
+            return int(keep_format(str(value), self.salt))
+
+        if type(value) is dict:
+            value = json.dumps(value)
+        elif isinstance(value, (bytes, memoryview)):
+            value = bytes(value).hex()
+        elif type(value) is not str:
+            value = str(value)
+
+        return keep_format(value, self.salt)
+
+    def scramble_line(self, line: str) -> str:
+        return '\t'.join([field if field == '\\N'
+                          else encode_field(keep_format(decode_copy_value(field), self.salt))
+                          for field in line.split('\t')])
+
+
+class Recorder:
+    def __init__(self, path: str, values: str = 'full'):
+        if values not in VALUE_MODES:
+            raise ValueError(f'unknown recording mode: {values}')
+
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.lock = threading.Lock()
+        self.counter = itertools.count(1)
+        self.scrambler = Scrambler() if values == 'masked' else None
+        self.write('format', FORMAT, VERSION)
+
+    def connect(self, dsn: str) -> 'RecordingConnection':
+        return RecordingConnection(psycopg2.connect(dsn), self)
+
+    def write(self, *event: Any) -> None:
+        line = json.dumps(event, separators=(',', ':'))
+
+        with self.lock:
+            self.file.write(line + '\n')
+
+    @staticmethod
+    def get_rows(rows: List[tuple]) -> List[tuple]:
+        return [tuple([bytes(value) if isinstance(value, memoryview) else value
+                       for value in row]) for row in rows]
+
+    def scramble_rows(self, rows: List[tuple]) -> List[tuple]:
+        if not self.scrambler:
+            return rows
+
+        return [tuple([self.scrambler.scramble(value) for value in row]) for row in rows]
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class RecordingStream:
+    def __init__(self, recorder: Recorder, query_id: int, output: IO):
+        self.recorder = recorder
+        self.query_id = query_id
+        self.output = output
+        self.tail = ''
+
+    def write(self, data: Any) -> int:
+        written = self.output.write(data)
+
+        if isinstance(data, str) and self.recorder.scrambler:
+            lines = (self.tail + data).split('\n')
+            self.tail = lines.pop()
+            if lines:
+                self.recorder.write('copy', self.query_id, ''.join(
+                    [self.recorder.scrambler.scramble_line(line) + '\n' for line in lines]))
+        elif isinstance(data, str):
+            self.recorder.write('copy', self.query_id, data)
+        elif self.recorder.scrambler:
+            raise ValueError('masked recordings do not support binary COPY')
+        else:
+            self.recorder.write('copy', self.query_id, encode_value(bytes(data)))
+
+        return written if written is not None else len(data)
+
+    def flush_tail(self) -> None:
+        if self.tail:
+            self.recorder.write('copy', self.query_id,
+                                self.recorder.scrambler.scramble_line(self.tail))
+            self.tail = ''
+
+
+class RecordingTextStream(RecordingStream, io.TextIOBase):
+    def writable(self) -> bool:
+        return True
+
+
+class RecordingBinaryStream(RecordingStream, io.RawIOBase):
+    def writable(self) -> bool:
+        return True
+
+
+class ResultCursor:
+    def __init__(self, connection: Any):
+        self.connection = connection
+        self.rows: Deque[tuple] = deque()
+        self.query_id = None
+
+    def fetchone(self) -> Optional[tuple]:
+        return self.rows.popleft() if self.rows else None
+
+    def fetchall(self) -> List[tuple]:
+        rows = list(self.rows)
+        self.rows.clear()
+
+        return rows
+
+    def fetchmany(self, size: int) -> List[tuple]:
+        return [self.rows.popleft() for _ in range(min(size, len(self.rows)))]
+
+    def __iter__(self):
+        while self.rows:
+            yield self.rows.popleft()
+
+
+class RecordingCursor(ResultCursor):
+    def __init__(self, connection: 'RecordingConnection', cursor: _cursor, named: bool):
+        super().__init__(connection)
+        self.recorder = connection.recorder
+        self.cursor = cursor
+        self.named = named
+
+    def execute(self, query, vars=None):
+        self.cursor.execute(query, vars)
+        self.query_id = next(self.recorder.counter)
+
+        rows = None
+        if not self.named and self.cursor.description is not None:
+            rows = self.recorder.get_rows(self.cursor.fetchall())
+
+        self.rows = deque(rows or [])
+        if rows and not CATALOG_RE.search(query):
+            rows = self.recorder.scramble_rows(rows)
+
+        self.recorder.write('query', self.query_id, get_query_key(query), encode_rows(rows))
+
+    def fetchmany(self, size: int) -> List[tuple]:
+        if not self.named:
+            return super().fetchmany(size)
+
+        rows = self.recorder.get_rows(self.cursor.fetchmany(size))
+        self.recorder.write('batch', self.query_id, encode_rows(self.recorder.scramble_rows(rows)))
+
+        return rows
+
+    def copy_expert(self, sql, file, size=8192):
+        self.query_id = next(self.recorder.counter)
+        self.recorder.write('query', self.query_id, get_query_key(sql), None)
+
+        if not COPY_TO_RE.search(sql):
+            return self.cursor.copy_expert(sql, file, size)
+
+        stream = RecordingTextStream(self.recorder, self.query_id, file) \
+            if isinstance(file, io.TextIOBase) \
+            else RecordingBinaryStream(self.recorder, self.query_id, file)
+        self.cursor.copy_expert(sql, stream, size)
+        stream.flush_tail()
+
+    def close(self) -> None:
+        self.cursor.close()
+
+
+class RecordingConnection:
+    def __init__(self, connection: _connection, recorder: Recorder):
+        self.connection = connection
+        self.recorder = recorder
+
+    @property
+    def autocommit(self) -> bool:
+        return self.connection.autocommit
+
+    @autocommit.setter
+    def autocommit(self, value: bool) -> None:
+        self.connection.autocommit = value
+
+    def cursor(self, name: str = None, withhold: bool = False) -> RecordingCursor:
+        return RecordingCursor(self, self.connection.cursor(name, withhold=withhold),
+                               name is not None)
+
+    def __getattr__(self, name: str):
+        return getattr(self.connection, name)
+
+
+class Player:
+    queries: Dict[str, Deque[Tuple[int, Optional[List[tuple]]]]]
+    batches: Dict[int, Deque[List[tuple]]]
+    chunks: Dict[int, List[Any]]
+
+    def __init__(self, path: str):
+        self.queries = defaultdict(deque)
+        self.batches = defaultdict(deque)
+        self.chunks = defaultdict(list)
+        self.lock = threading.Lock()
+
+        with gzip.open(path, 'rt', encoding='utf-8') as recording:
+            try:
+                header = json.loads(recording.readline())
+            except (OSError, ValueError):
+                header = None
+
+            if header != ['format', FORMAT, VERSION]:
+                raise ValueError(f'{path}: not a pg-slicer recording of version {VERSION}')
+
+            for line in recording:
+                event = json.loads(line)
+
+                if event[0] == 'query':
+                    self.queries[event[2]].append((event[1], decode_rows(event[3])))
+                elif event[0] == 'batch':
+                    self.batches[event[1]].append(decode_rows(event[2]))
+                else:
+                    self.chunks[event[1]].append(decode_value(event[2]))
+
+    def connect(self, dsn: str) -> 'ReplayConnection':
+        return ReplayConnection(self)
+
+    def get_query(self, query: str) -> Tuple[int, Optional[List[tuple]]]:
+        key = get_query_key(query)
+
+        with self.lock:
+            if not self.queries[key]:
+                raise ValueError(f'no recorded result for query: {key[:200]}')
+
+            return self.queries[key].popleft()
+
+    def get_batch(self, query_id: int) -> List[tuple]:
+        with self.lock:
+            return self.batches[query_id].popleft() if self.batches[query_id] else []
+
+
+class ReplayCursor(ResultCursor):
+    def __init__(self, connection: 'ReplayConnection', named: bool):
+        super().__init__(connection)
+        self.player = connection.player
+        self.named = named
+
+    def execute(self, query, vars=None):
+        self.query_id, rows = self.player.get_query(query)
+        self.rows = deque(rows or [])
+
+    def fetchmany(self, size: int) -> List[tuple]:
+        if not self.named:
+            return super().fetchmany(size)
+
+        return self.player.get_batch(self.query_id)
+
+    def copy_expert(self, sql, file, size=8192):
+        self.query_id, _ = self.player.get_query(sql)
+
+        if not COPY_TO_RE.search(sql):
+            while file.read(size):
+                pass
+
+            return
+
+        for chunk in self.player.chunks.pop(self.query_id, []):
+            file.write(chunk)
+
+    def close(self) -> None:
+        pass
+
+
+class ReplayConnection:
+    def __init__(self, player: Player):
+        self.player = player
+        self.autocommit = False
+        self.closed = False
+
+    def cursor(self, name: str = None, withhold: bool = False) -> ReplayCursor:
+        return ReplayCursor(self, name is not None)
+
+    def set_session(self, **kwargs) -> None:
+        pass
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
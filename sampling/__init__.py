@@ -0,0 +1,150 @@
+import math
+import random
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from psycopg2.extensions import cursor as _cursor
+
+from key_store import INT_TYPES
+from schema_generator import Table
+
+
+class Sampling:
+    METHODS = ['pk', 'first-column', 'newest', 'system', 'bernoulli', 'random-key']
+    ORDERED_METHODS = ['pk', 'first-column', 'newest']
+    OVERSAMPLE = 2
+    MIN_BLOCKS = 16
+    MAX_RANDOM_KEYS = 100000
+
+    def __init__(self, method: str = 'pk', column: str = None, seed: int = None):
+        if method not in self.METHODS:
+            raise ValueError(f'unknown sampling method: {method}')
+
+        if method == 'newest' and not column:
+            raise ValueError('newest sampling requires a column')
+
+        self.method = method
+        self.column = column
+        self.seed = seed
+
+    @classmethod
+    def parse(cls, spec: Union[None, str, Dict[str, Any]], seed: int = None) -> 'Sampling':
+        if not spec:
+            return cls(seed=seed)
+
+        if isinstance(spec, dict):
+            return cls(spec.get('method', 'pk'), spec.get('column'), spec.get('seed', seed))
+
+        method, _, column = str(spec).partition(':')
+
+        return cls(method, column or None, seed)
+
+    def get_order(self, table: Table) -> str:
+        if self.method == 'newest' \
+                and any([column.name == self.column for column in table.columns]):
+            return f'{table.name}.{self.column} DESC NULLS LAST'
+
+        identity = table.get_identity()
+        if self.method == 'first-column' or not identity:
+            return '1 DESC'
+
+        return ', '.join([f'{table.name}.{column.name} DESC' for column in identity])
+
+    def get_query(self,
+                  table: Table,
+                  columns: str,
+                  where: str,
+                  limit: Union[int, str],
+                  cursor: _cursor,
+                  partitions: int = None,
+                  keyed: bool = False) -> str:
+        targets = self.get_partitions(table, partitions, cursor) \
+            if partitions and limit != 'ALL' else None
+        select = f'SELECT {columns} FROM {self.get_source(table, targets)}'
+
+        if limit == 'ALL' or keyed or self.method in self.ORDERED_METHODS:
+            return f'{select} WHERE {where} ORDER BY {self.get_order(table)} LIMIT {limit}'
+
+        if self.method == 'random-key':
+            keys = self.get_random_keys(table, limit, cursor, targets)
+            if keys is not None:
+                return f'{select} WHERE {keys} AND ({where}) LIMIT {limit}'
+
+            return f'{select} WHERE {where} ORDER BY {self.get_order(table)} LIMIT {limit}'
+
+        percent = self.get_percent(targets or [table.name], limit, cursor)
+        repeatable = f' REPEATABLE ({int(self.seed)})' if self.seed is not None else ''
+        sample = f' TABLESAMPLE {self.method.upper()} ({percent}){repeatable}'
+
+        return f'SELECT {columns} FROM {self.get_source(table, targets, sample)} ' \
+               f'WHERE {where} LIMIT {limit}'
+
+    @staticmethod
+    def get_partitions(table: Table, count: int, cursor: _cursor) -> Optional[List[str]]:
+        if not table.partitions:
+            return None
+
+        cursor.execute('SELECT c.relname FROM pg_catalog.pg_class c '
+                       'WHERE c.oid = ANY(%s::pg_catalog.regclass[]) '
+                       'AND (c.relkind <> \'r\' OR c.reltuples <> 0)',
+                       (table.partitions,))
+        filled = {row[0] for row in cursor.fetchall()}
+        partitions = [name for name in table.partitions if name in filled][:count]
+
+        return partitions if partitions and len(partitions) < len(table.partitions) else None
+
+    @staticmethod
+    def get_source(table: Table, partitions: Optional[List[str]], sample: str = '') -> str:
+        if not partitions:
+            return f'{table.name}{sample}'
+
+        columns = ', '.join([column.name for column in table.columns])
+        union = ' UNION ALL '.join([f'SELECT {columns} FROM {partition}{sample}'
+                                    for partition in partitions])
+
+        return f'({union}) AS {table.name}'
+
+    @staticmethod
+    def get_size(relations: List[str], cursor: _cursor) -> Tuple[float, int]:
+        cursor.execute('SELECT coalesce(sum(greatest(c.reltuples, 0)), 0), '
+                       'coalesce(sum(c.relpages), 0) FROM pg_catalog.pg_class c '
+                       'WHERE c.relkind = \'r\' AND (c.oid = ANY(%s::pg_catalog.regclass[]) '
+                       'OR c.oid IN (SELECT t.relid FROM unnest(%s::pg_catalog.regclass[]) r, '
+                       'pg_catalog.pg_partition_tree(r) t))', (relations, relations))
+        row = cursor.fetchone()
+
+        return (float(row[0]), int(row[1])) if row else (0.0, 0)
+
+    def get_percent(self, relations: List[str], limit: int, cursor: _cursor) -> float:
+        reltuples, relpages = self.get_size(relations, cursor)
+        if reltuples <= 0:
+            return 100
+
+        percent = 100 * limit * self.OVERSAMPLE / reltuples
+        if self.method == 'system' and relpages > 0:
+            percent = max(percent, 100 * self.MIN_BLOCKS / relpages)
+
+        return min(100, round(percent, 6))
+
+    def get_random_keys(self,
+                        table: Table,
+                        limit: int,
+                        cursor: _cursor,
+                        partitions: List[str] = None) -> Optional[str]:
+        identity = table.get_identity()
+        if not identity or len(identity) != 1 or identity[0].type not in INT_TYPES:
+            return None
+
+        column = identity[0].name
+        cursor.execute(f'SELECT min({column}), max({column}) '
+                       f'FROM {self.get_source(table, partitions)}')
+        low, high = cursor.fetchone()
+        if low is None:
+            return None
+
+        span = high - low + 1
+        reltuples, _ = self.get_size(partitions or [table.name], cursor)
+        density = min(1.0, reltuples / span) if reltuples > 0 else 1.0
+        count = min(span, self.MAX_RANDOM_KEYS, math.ceil(limit * self.OVERSAMPLE / density))
+        keys = random.Random(self.seed).sample(range(low, high + 1), count)
+
+        return f'{column} IN (%s)' % ','.join([str(key) for key in sorted(keys)])
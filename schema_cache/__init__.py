@@ -0,0 +1,110 @@
+import hashlib
+import pickle
+from os import getenv
+from pathlib import Path
+from typing import Optional
+
+from psycopg2.extensions import cursor as _cursor
+
+from options import Options
+from schema_generator import SchemaGenerator
+
+
+class SchemaCache:
+    VERSION = 5
+    CATALOGS = ['pg_attrdef', 'pg_attribute', 'pg_class', 'pg_constraint', 'pg_description',
+                'pg_extension', 'pg_index', 'pg_inherits', 'pg_namespace', 'pg_rewrite']
+
+    cursor: _cursor
+    options: Options
+    directory: Path
+
+    def __init__(self, cursor: _cursor, options: Options):
+        self.cursor = cursor
+        self.options = options
+
+        if options.schema_cache_dir:
+            self.directory = Path(options.schema_cache_dir)
+        else:
+            self.directory = Path(getenv('XDG_CACHE_HOME') or Path.home().joinpath('.cache'))\
+                .joinpath('pg-slicer')
+
+    def get_path(self) -> Path:
+        key = f'{self.options.host}:{self.options.port}:{self.options.user}:{self.options.DBNAME}'
+        if self.options.split_sections:
+            key += ':split'
+
+        return self.directory.joinpath(hashlib.sha1(key.encode()).hexdigest() + '.schema')
+
+    def get_fingerprint(self) -> str:
+        parts = [f'SELECT \'{catalog}\', count(*) || \':\' || '
+                 f'coalesce(max(xmin::text::bigint), 0) FROM pg_catalog.{catalog}'
+                 for catalog in self.CATALOGS]
+
+        self.cursor.execute('SELECT pg_catalog.md5(pg_catalog.version() || current_user || '
+                            'pg_catalog.current_setting(\'search_path\') || '
+                            'string_agg(f.catalog || \'=\' || f.state, \',\' ORDER BY f.catalog)) '
+                            'FROM (' + ' UNION ALL '.join(parts) + ') AS f(catalog, state)')
+
+        return self.cursor.fetchone()[0]
+
+    def load(self, schema_generator: SchemaGenerator, fingerprint: Optional[str] = None) -> bool:
+        try:
+            with open(self.get_path(), 'rb') as cache_file:
+                snapshot = pickle.load(cache_file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return False
+
+        if not isinstance(snapshot, dict) or snapshot.get('version') != self.VERSION \
+                or snapshot.get('fingerprint') != (fingerprint or self.get_fingerprint()):
+            return False
+
+        schema_generator.tables = snapshot['tables']
+        schema_generator.sequences = snapshot['sequences']
+        schema_generator.schema = snapshot['schema']
+        schema_generator.post_data = snapshot['post_data']
+
+        return True
+
+    def save(self, schema_generator: SchemaGenerator, fingerprint: Optional[str] = None) -> None:
+        snapshot = {
+            'version': self.VERSION,
+            'fingerprint': fingerprint or self.get_fingerprint(),
+            'tables': schema_generator.tables,
+            'sequences': schema_generator.sequences,
+            'schema': schema_generator.schema,
+            'post_data': schema_generator.post_data,
+        }
+
+        path = self.get_path()
+        tmp_path = path.with_suffix('.tmp')
+
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'wb') as cache_file:
+                pickle.dump(snapshot, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(path)
+        except OSError:
+            return
+
+    def invalidate(self) -> None:
+        try:
+            self.get_path().unlink()
+        except OSError:
+            return
+
+    def generate_schema(self, schema_generator: SchemaGenerator) -> str:
+        if self.options.clear_schema_cache:
+            self.invalidate()
+
+        if self.options.no_schema_cache:
+            return schema_generator.generate_schema()
+
+        fingerprint = self.get_fingerprint()
+        if self.load(schema_generator, fingerprint):
+            return schema_generator.schema
+
+        schema_generator.generate_schema()
+        self.save(schema_generator, fingerprint)
+
+        return schema_generator.schema
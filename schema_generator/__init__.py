@@ -1,7 +1,14 @@
-from typing import List, Optional
+import re
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple, Union
 
 from psycopg2.extensions import cursor as _cursor
 
+from dependency_graph import DependencyGraph
+from options import Options
+
+PARTITION_BOUND_RE = re.compile(r'FROM \((.*?)\) TO')
+
 
 class Column:
     def __init__(self,
@@ -25,12 +32,18 @@ class Index:
                  is_primary: bool,
                  is_unique: bool,
                  create_query: str,
-                 constraint_query: str):
+                 constraint_query: str,
+                 columns: List[int] = None,
+                 is_partial: bool = False,
+                 is_inherited: bool = False):
         self.name = name
         self.is_primary = is_primary
         self.is_unique = is_unique
         self.create_query = create_query
         self.constraint_query = constraint_query
+        self.columns = columns or []
+        self.is_partial = is_partial
+        self.is_inherited = is_inherited
 
 
 class Relation:
@@ -60,11 +73,53 @@ class Table:
                  name: str,
                  columns: List[Column] = None,
                  indexes: List[Index] = None,
-                 relations: List[Relation] = None):
+                 relations: List[Relation] = None,
+                 partition_of: str = None,
+                 partition_bound: str = None,
+                 partition_key: str = None):
         self.name = name
         self.columns = columns
         self.indexes = indexes
         self.relations = relations
+        self.partition_of = partition_of
+        self.partition_bound = partition_bound
+        self.partition_key = partition_key
+        self.partitions = []
+        self.columns_by_position = None
+
+    def is_partition(self) -> bool:
+        return self.partition_of is not None
+
+    def get_bound_order(self) -> Tuple[int, Union[float, str]]:
+        match = PARTITION_BOUND_RE.search(self.partition_bound or '')
+        if not match:
+            return 0, 0.0
+
+        value = match.group(1).split(',')[0].strip().strip('\'')
+        if value == 'MINVALUE':
+            return 1, float('-inf')
+
+        try:
+            return 2, float(value)
+        except ValueError:
+            return 3, value
+
+    def get_column_at(self, position: int) -> Optional[Column]:
+        if self.columns_by_position is None:
+            self.columns_by_position = {column.position: column for column in self.columns}
+
+        return self.columns_by_position.get(position)
+
+    def get_identity(self) -> Optional[List[Column]]:
+        for index in self.indexes:
+            if not index.is_unique or index.is_partial or not index.columns:
+                continue
+
+            columns = [self.get_column_at(position) for position in index.columns]
+            if all([column and not column.is_null for column in columns]):
+                return columns
+
+        return None
 
 
 class Sequence:
@@ -81,14 +136,19 @@ class Sequence:
 
 class SchemaGenerator:
     tables: List[Table]
+    tables_by_name: Dict[str, Table]
     sequences: List[Sequence]
     schema: str
+    post_data: List[str]
 
-    def __init__(self, cursor: _cursor):
+    def __init__(self, cursor: _cursor, options: Options = None):
         self.cursor = cursor
+        self.options = options
         self.tables = []
+        self.tables_by_name = {}
         self.sequences = []
         self.schema = ''
+        self.post_data = []
 
     def describe_table(self, table_name: str):
         table = Table(table_name)
@@ -117,7 +177,10 @@ class SchemaGenerator:
         self.cursor.execute('SELECT c2.relname, i.indisprimary, i.indisunique, i.indisclustered, '
                             'i.indisvalid, pg_catalog.pg_get_indexdef(i.indexrelid, 0, true), '
                             'pg_catalog.pg_get_constraintdef(con.oid, true), contype, '
-                            'condeferrable, condeferred, i.indisreplident, c2.reltablespace '
+                            'condeferrable, condeferred, i.indisreplident, c2.reltablespace, '
+                            'i.indkey::pg_catalog.int2[], i.indpred IS NOT NULL, '
+                            'EXISTS (SELECT 1 FROM pg_catalog.pg_inherits ih '
+                            'WHERE ih.inhrelid = i.indexrelid) '
                             'FROM pg_catalog.pg_class c, pg_catalog.pg_class c2, '
                             'pg_catalog.pg_index i LEFT JOIN pg_catalog.pg_constraint con '
                             'ON (conrelid = i.indrelid AND conindid = i.indexrelid AND contype '
@@ -146,7 +209,8 @@ class SchemaGenerator:
 
         table.columns = [Column(column[0], column[1], column[2], column[3], column[4], column[11])
                          for column in columns]
-        table.indexes = [Index(index[0], index[1], index[2], index[5], index[6])
+        table.indexes = [Index(index[0], index[1], index[2], index[5], index[6], index[12],
+                               index[13], index[14])
                          for index in indexes]
         table.relations = [Relation(relation[1], relation[0], relation[2], relation[3])
                            for relation in relations]
@@ -165,8 +229,77 @@ class SchemaGenerator:
 
         return table
 
+    def describe_tables(self, tables: List[Tuple[str, int]]) -> List[Table]:
+        oids = [oid for _, oid in tables]
+
+        self.cursor.execute('SELECT a.attrelid, a.attname, '
+                            'pg_catalog.format_type(a.atttypid, a.atttypmod), '
+                            '(SELECT substring(pg_catalog.pg_get_expr(d.adbin, d.adrelid) for 128) '
+                            'FROM pg_catalog.pg_attrdef d WHERE d.adrelid = a.attrelid '
+                            'AND d.adnum = a.attnum AND a.atthasdef), a.attnotnull, a.attnum, '
+                            'pg_catalog.col_description(a.attrelid, a.attnum) '
+                            'FROM pg_catalog.pg_attribute a '
+                            'WHERE a.attrelid = ANY(%s::pg_catalog.oid[]) '
+                            'AND a.attnum > 0 AND NOT a.attisdropped '
+                            'ORDER BY a.attrelid, a.attnum', (oids,))
+        columns = defaultdict(list)
+        for row in self.cursor.fetchall():
+            columns[row[0]].append(Column(row[1], row[2], row[3], row[4], row[5], row[6]))
+
+        self.cursor.execute('SELECT c.oid, c2.relname, i.indisprimary, i.indisunique, '
+                            'pg_catalog.pg_get_indexdef(i.indexrelid, 0, true), '
+                            'pg_catalog.pg_get_constraintdef(con.oid, true), '
+                            'i.indkey::pg_catalog.int2[], i.indpred IS NOT NULL, '
+                            'EXISTS (SELECT 1 FROM pg_catalog.pg_inherits ih '
+                            'WHERE ih.inhrelid = i.indexrelid) '
+                            'FROM pg_catalog.pg_class c, pg_catalog.pg_class c2, '
+                            'pg_catalog.pg_index i LEFT JOIN pg_catalog.pg_constraint con '
+                            'ON (conrelid = i.indrelid AND conindid = i.indexrelid AND contype '
+                            'IN (\'p\',\'u\',\'x\')) '
+                            'WHERE c.oid = ANY(%s::pg_catalog.oid[]) AND c.oid = i.indrelid '
+                            'AND i.indexrelid = c2.oid ORDER BY c.oid, i.indisprimary DESC, '
+                            'i.indisunique DESC, c2.relname', (oids,))
+        indexes = defaultdict(list)
+        for row in self.cursor.fetchall():
+            indexes[row[0]].append(Index(row[1], row[2], row[3], row[4], row[5], row[6], row[7],
+                                         row[8]))
+
+        self.cursor.execute('SELECT r.conrelid, conname, confrelid::pg_catalog.regclass, '
+                            'pg_catalog.pg_get_constraintdef(r.oid, true) as condef, conkey, '
+                            'confkey '
+                            'FROM pg_catalog.pg_constraint r '
+                            'WHERE r.conrelid = ANY(%s::pg_catalog.oid[]) '
+                            'AND r.contype = \'f\' '
+                            'ORDER BY r.conrelid, conname', (oids,))
+        parents = defaultdict(list)
+        for row in self.cursor.fetchall():
+            relation = Relation(row[2], row[1], row[3], 'parent')
+            if row[4] and row[5] and len(row[4]) == 1 and len(row[5]) == 1:
+                [[relation.src], [relation.dest]] = [row[4], row[5]]
+
+            parents[row[0]].append(relation)
+
+        self.cursor.execute('SELECT c.confrelid, conname, conrelid::pg_catalog.regclass, '
+                            'pg_catalog.pg_get_constraintdef(c.oid, true) as condef '
+                            'FROM pg_catalog.pg_constraint c '
+                            'WHERE c.confrelid = ANY(%s::pg_catalog.oid[]) '
+                            'AND c.contype = \'f\' '
+                            'ORDER BY c.confrelid, conname', (oids,))
+        children = defaultdict(list)
+        for row in self.cursor.fetchall():
+            children[row[0]].append(Relation(row[2], row[1], row[3], 'child'))
+
+        return [Table(table_name, columns[oid], indexes[oid], parents[oid] + children[oid])
+                for table_name, oid in tables]
+
     def get_tables(self):
-        self.cursor.execute('SELECT c.relname '
+        self.cursor.execute('SELECT c.relname, c.oid, (SELECT p.relname '
+                            'FROM pg_catalog.pg_inherits ih '
+                            'JOIN pg_catalog.pg_class p ON p.oid = ih.inhparent '
+                            'WHERE ih.inhrelid = c.oid AND c.relispartition), '
+                            'pg_catalog.pg_get_expr(c.relpartbound, c.oid), '
+                            'CASE WHEN c.relkind = \'p\' '
+                            'THEN pg_catalog.pg_get_partkeydef(c.oid) END '
                             'FROM pg_catalog.pg_class c '
                             'LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace '
                             'WHERE c.relkind IN (\'r\',\'p\',\'\') '
@@ -174,33 +307,61 @@ class SchemaGenerator:
                             'AND n.nspname <> \'information_schema\' '
                             'AND n.nspname !~ \'^pg_toast\' '
                             'AND pg_catalog.pg_table_is_visible(c.oid)')
+        rows = [row for row in self.cursor.fetchall() if row[0]]
+        tables = [(row[0], row[1]) for row in rows]
 
-        self.tables = [self.describe_table(row[0]) for row in self.cursor.fetchall() if row[0]]
+        if self.options and self.options.bulk_introspection:
+            self.tables = self.describe_tables(tables)
+        else:
+            self.tables = [self.describe_table(table_name) for table_name, _ in tables]
 
-    def get_root_tables(self) -> List[str]:
-        root_tables = []
+        for table, row in zip(self.tables, rows):
+            table.partition_of, table.partition_bound, table.partition_key = row[2:5]
+
+        self.get_partitions()
 
+    def get_partitions(self):
+        self.tables_by_name = {}
         for table in self.tables:
-            root_table = True
-            for relation in table.relations:
-                if relation.is_parent():
-                    root_table = False
+            table.partitions = []
 
-                    break
+        for table in self.tables:
+            parent = self.get_table(table.partition_of) if table.partition_of else None
+            if parent:
+                parent.partitions.append(table.name)
+            else:
+                table.partition_of = None
 
-            if root_table and table.name not in root_tables:
-                root_tables.append(table.name)
+        for table in self.tables:
+            table.partitions.sort(key=lambda name: self.get_table(name).get_bound_order(),
+                                  reverse=True)
+
+    def get_data_tables(self) -> List[Table]:
+        return [table for table in self.tables if not table.is_partition()]
+
+    def get_root_tables(self) -> List[str]:
+        return [table.name for table in self.tables
+                if not any([relation.is_parent() for relation in table.relations])]
 
-        return root_tables
+    def is_split(self) -> bool:
+        return bool(self.options and self.options.split_sections)
 
     def generate_create_table(self, table: Table):
         table_query = f'CREATE TABLE IF NOT EXISTS "{table.name}" (\n'
 
         column_queries = []
-        index_queries = [idx.create_query for idx in table.indexes if not idx.constraint_query]
-        constraint_queries = [idx.constraint_query for idx in table.indexes if idx.constraint_query]
+        indexes = [idx for idx in table.indexes if not idx.is_inherited]
+        index_queries = [idx.create_query for idx in indexes if not idx.constraint_query]
+        constraint_queries = [idx.constraint_query for idx in indexes if idx.constraint_query]
         comments = []
 
+        if self.is_split():
+            self.post_data += [f'ALTER TABLE "{table.name}" ADD CONSTRAINT "{idx.name}" '
+                               f'{idx.constraint_query};'
+                               for idx in indexes if idx.constraint_query]
+            self.post_data += [f'{query};' for query in index_queries]
+            index_queries, constraint_queries = [], []
+
         for column in table.columns:
             column_query = f'"{column.name}" {column.type}'
             column_query += f' DEFAULT {column.default}' if column.default else ''
@@ -212,9 +373,18 @@ class SchemaGenerator:
                 comments.append(
                     f'COMMENT ON COLUMN "{table.name}"."{column.name}" IS \'{column.comment}\'')
 
-        table_query += ',\n'.join(column_queries)
-        table_query += ',\n' + ',\n'.join(constraint_queries) if constraint_queries else ''
-        table_query += '\n);\n'
+        if table.is_partition():
+            table_query = f'CREATE TABLE IF NOT EXISTS "{table.name}" ' \
+                          f'PARTITION OF "{table.partition_of}" {table.partition_bound}'
+            table_query += ' (\n' + ',\n'.join(constraint_queries) + '\n)' \
+                if constraint_queries else ''
+            table_query += ';\n'
+        else:
+            table_query += ',\n'.join(column_queries)
+            table_query += ',\n' + ',\n'.join(constraint_queries) if constraint_queries else ''
+            table_query += '\n)'
+            table_query += f' PARTITION BY {table.partition_key};\n' \
+                if table.partition_key else ';\n'
         table_query += ';\n'.join(index_queries) + ';\n' if index_queries else ''
 
         for comment in comments:
@@ -222,29 +392,18 @@ class SchemaGenerator:
 
         self.schema += table_query + '\n'
 
-    def generate_create_table_recursive(self, table: Table, processed_tables: list):
-        processed_tables.append(table.name)
-        parent_tables = [relation.table_name for relation in table.relations
-                         if relation.is_parent()
-                         and relation.table_name not in processed_tables]
-
-        for parent_table in parent_tables:
-            if parent_table in processed_tables:
-                continue
-
-            processed_tables.append(parent_table)
-            self.generate_create_table_recursive(self.get_table(parent_table), processed_tables)
-
-        self.generate_create_table(table)
+        for partition_name in reversed(table.partitions):
+            self.generate_create_table(self.get_table(partition_name))
 
     def get_table(self, table_name: str) -> Optional[Table]:
-        for table in self.tables:
-            if table.name == table_name:
-                return table
+        if len(self.tables_by_name) != len(self.tables):
+            self.tables_by_name = {table.name: table for table in self.tables}
 
-        return None
+        return self.tables_by_name.get(table_name)
 
     def generate_schema(self):
+        self.schema = ''
+        self.post_data = []
         self.generate_extensions()
         self.get_sequences()
 
@@ -252,18 +411,11 @@ class SchemaGenerator:
             self.generate_sequence(sequence)
 
         self.get_tables()
-        processed_tables = []
-
-        for table_name in self.get_root_tables():
-            self.generate_create_table(self.get_table(table_name))
-            processed_tables.append(table_name)
 
-        while len(processed_tables) < len(self.tables):
-            for table in self.tables:
-                if table.name in processed_tables:
-                    continue
-
-                self.generate_create_table_recursive(table, processed_tables)
+        for layer in DependencyGraph(self.get_data_tables()).get_layers():
+            for component in layer:
+                for table_name in component:
+                    self.generate_create_table(self.get_table(table_name))
 
         self.generate_views()
 
@@ -284,20 +436,29 @@ class SchemaGenerator:
                             'AND n.nspname <> \'information_schema\' '
                             'AND n.nspname !~ \'^pg_toast\' '
                             'AND pg_catalog.pg_table_is_visible(c.oid)')
+        sequence_names = [r[0] for r in self.cursor.fetchall() if r[0]]
 
-        self.sequences = [self.describe_sequence(r[0]) for r in self.cursor.fetchall() if r[0]]
+        if self.options and self.options.bulk_introspection:
+            self.sequences = self.describe_sequences(sequence_names)
+        else:
+            self.sequences = [self.describe_sequence(sequence_name)
+                              for sequence_name in sequence_names]
 
     def describe_sequence(self, sequence_name: str) -> Sequence:
-        sequence = Sequence(sequence_name, min_value=1, increment_by=1)
-        try:
-            self.cursor.execute('SELECT currval(%s::regclass)', (sequence_name,))
-            row = self.cursor.fetchone()
-        except:
-            row = [1]
+        return self.describe_sequences([sequence_name])[0]
 
-        sequence.start_value = row[0]
+    def describe_sequences(self, sequence_names: List[str]) -> List[Sequence]:
+        self.cursor.execute('SELECT s.sequencename, coalesce(s.last_value, s.start_value), '
+                            's.min_value, s.increment_by FROM pg_catalog.pg_sequences s '
+                            'WHERE s.sequencename = ANY(%s) '
+                            'AND pg_catalog.pg_table_is_visible(pg_catalog.format(\'%%I.%%I\', '
+                            's.schemaname, s.sequencename)::pg_catalog.regclass)',
+                            (sequence_names,))
+        rows = {row[0]: row for row in self.cursor.fetchall()}
 
-        return sequence
+        return [Sequence(sequence_name, *rows[sequence_name][1:]) if sequence_name in rows
+                else Sequence(sequence_name, start_value=1, min_value=1, increment_by=1)
+                for sequence_name in sequence_names]
 
     def generate_extensions(self):
         self.cursor.execute('SELECT e.extname, n.nspname, c.description '
@@ -330,6 +491,7 @@ WHERE c.relkind IN ('v', 'm')
   AND c.relname !~ '^pg_';
         """)
 
+        views = ''
         for row in self.cursor:
             view_name = row[0]
             view_query = row[1]
@@ -339,4 +501,21 @@ WHERE c.relkind IN ('v', 'm')
                 query += ' MATERIALIZED'
             query += f' VIEW {view_name} AS {view_query};\n\n'
 
-            self.schema += query
+            views += query
+
+        if not self.is_split():
+            self.schema += views
+        elif views:
+            self.post_data.append(views.strip())
+
+    def generate_sequence_values(self) -> List[str]:
+        sequence_names = [sequence.name for sequence in self.sequences]
+        self.cursor.execute('SELECT s.sequencename, s.last_value FROM pg_catalog.pg_sequences s '
+                            'WHERE s.last_value IS NOT NULL '
+                            'AND s.sequencename = ANY(%s) '
+                            'AND pg_catalog.pg_table_is_visible(pg_catalog.format(\'%%I.%%I\', '
+                            's.schemaname, s.sequencename)::pg_catalog.regclass)',
+                            (sequence_names,))
+
+        return [f'SELECT pg_catalog.setval(\'{row[0]}\', {row[1]}, true);'
+                for row in self.cursor.fetchall()]
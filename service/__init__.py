@@ -0,0 +1,369 @@
+import copy
+import io
+import json
+import queue
+import re
+import sys
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import IO, Any, Callable, Dict, List, Tuple, Union
+
+import psycopg2
+from psycopg2.extensions import connection as _connection, cursor as _cursor
+
+from data_generator import DataGenerator
+from options import Options
+from output import DirectoryOutput, StreamOutput, TargetOutput
+from sampling import Sampling
+from schema_cache import SchemaCache
+from schema_generator import SchemaGenerator
+
+INTEGER_RE = re.compile(r'\d+')
+
+
+def get_integer(name: str, value: Any, minimum: int = 0, maximum: int = None) -> int:
+    if isinstance(value, str) and INTEGER_RE.fullmatch(value.strip()):
+        value = int(value)
+
+    if type(value) is not int or value < minimum or maximum is not None and value > maximum:
+        limits = f'between {minimum} and {maximum}' if maximum is not None \
+            else f'at least {minimum}'
+
+        raise ValueError(f'{name} must be an integer {limits}')
+
+    return value
+
+
+def get_choice(choices: List[str], name: str, value: Any) -> str:
+    if value not in choices:
+        raise ValueError(f'{name} must be one of {", ".join(choices)}')
+
+    return value
+
+
+def get_string(name: str, value: Any) -> str:
+    if not isinstance(value, str) or not value:
+        raise ValueError(f'{name} must be a non-empty string')
+
+    return value
+
+
+def get_sampling(name: str, value: Any) -> Union[str, Dict[str, Any]]:
+    if not isinstance(value, (str, dict)):
+        raise ValueError(f'{name} must be a string or an object')
+
+    if isinstance(value, dict) and value.get('seed') is not None:
+        value = dict(value, seed=get_integer(f'{name}.seed', value['seed']))
+
+    Sampling.parse(value)
+
+    return value
+
+
+def get_columns(name: str, value: Any) -> Dict[str, Any]:
+    if not isinstance(value, dict):
+        raise ValueError(f'{name} must be an object of columns')
+
+    return value
+
+
+def get_limit(name: str, value: Any) -> Union[int, str]:
+    return value if value == '*' else get_integer(name, value)
+
+
+REQUEST_OPTIONS: Dict[str, Callable[[str, Any], Any]] = {
+    'limit': get_integer,
+    'extraction': partial(get_choice, ['select', 'copy']),
+    'copy_format': partial(get_choice, ['text', 'binary']),
+    'batch_size': partial(get_integer, minimum=1),
+    'sampling': get_sampling,
+    'children': get_integer,
+    'partitions': get_integer,
+    'key_propagation': partial(get_choice, ['inline', 'array', 'temp-table']),
+}
+OUTPUT_OPTIONS: Dict[str, Callable[[str, Any], Any]] = {
+    'target_dsn': get_string,
+    'output_dir': get_string,
+    'compress': partial(get_integer, maximum=9),
+}
+TABLE_OPTIONS: Dict[str, Callable[[str, Any], Any]] = {
+    'limit': get_limit,
+    'sampling': get_sampling,
+    'children': get_integer,
+    'partitions': get_integer,
+    'copy_format': partial(get_choice, ['text', 'binary']),
+    'mask': get_columns,
+    'columns': get_columns,
+}
+CONDITION_OPTIONS: Dict[str, Callable[[str, Any], Any]] = {
+    'condition': get_string,
+}
+
+
+class ChunkedResponse(io.RawIOBase):
+    def __init__(self, stream: IO):
+        self.stream = stream
+        self.aborted = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        if data and not self.aborted:
+            self.stream.write(b'%x\r\n' % len(data) + bytes(data) + b'\r\n')
+
+        return len(data)
+
+    def finish(self) -> None:
+        self.stream.write(b'0\r\n\r\n')
+
+
+class SliceService:
+    connections: queue.Queue
+    schema: SchemaGenerator
+
+    def __init__(self, dsn: str, options: Options, connect: Callable[[str], _connection]):
+        self.dsn = dsn
+        self.options = options
+        self.connect = connect
+        self.connections = queue.Queue()
+        self.schema_lock = threading.Lock()
+        self.schema = None
+        self.fingerprint = None
+
+        for _ in range(max(1, options.jobs)):
+            self.connections.put(self.open_connection())
+
+        connection = self.connections.get()
+        try:
+            self.refresh_schema(connection.cursor())
+        finally:
+            self.connections.put(connection)
+
+    def open_connection(self) -> _connection:
+        connection = self.connect(self.dsn)
+        connection.autocommit = True
+
+        return connection
+
+    def get_address(self) -> Tuple[str, int]:
+        host, _, port = self.options.serve.rpartition(':')
+
+        return host or '127.0.0.1', int(port)
+
+    def serve(self) -> None:
+        server = SliceServer(self.get_address(), SliceRequestHandler, self)
+        sys.stderr.write('pg-slicer serving on http://%s:%d\n' % server.server_address[:2])
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            while not self.connections.empty():
+                self.connections.get().close()
+
+    def refresh_schema(self, cursor: _cursor) -> SchemaGenerator:
+        fingerprint = SchemaCache(cursor, self.options).get_fingerprint()
+
+        with self.schema_lock:
+            if self.schema is None or fingerprint != self.fingerprint:
+                schema = SchemaGenerator(cursor, self.options)
+                schema.generate_schema()
+                self.schema, self.fingerprint = schema, fingerprint
+
+            schema = copy.copy(self.schema)
+
+        schema.cursor = cursor
+
+        return schema
+
+    def get_request_options(self) -> Dict[str, Callable[[str, Any], Any]]:
+        if 'output' in (self.options.serve_allow or []):
+            return {**REQUEST_OPTIONS, **OUTPUT_OPTIONS}
+
+        return REQUEST_OPTIONS
+
+    def get_table_options(self) -> Dict[str, Callable[[str, Any], Any]]:
+        if 'conditions' in (self.options.serve_allow or []):
+            return {**TABLE_OPTIONS, **CONDITION_OPTIONS}
+
+        return TABLE_OPTIONS
+
+    def get_options(self, request: Dict[str, Any]) -> Options:
+        options = copy.deepcopy(self.options)
+        options.jobs = 1
+        request_options = self.get_request_options()
+        table_options = self.get_table_options()
+
+        for name in request.keys():
+            if name not in request_options.keys() and name not in ['masking', 'tables']:
+                raise ValueError(f'option not accepted: {name}')
+
+        for name, get_value in request_options.items():
+            if name in request.keys():
+                setattr(options, name, get_value(name, request[name]))
+
+        masking = request.get('masking') or {}
+        if not isinstance(masking, dict) or not isinstance(masking.get('dictionaries', {}), dict):
+            raise ValueError('masking must be an object with an object of dictionaries')
+
+        if 'salt' in masking:
+            options.mask_salt = get_string('masking.salt', str(masking['salt']))
+
+        for name, values in masking.get('dictionaries', {}).items():
+            if not isinstance(values, list):
+                raise ValueError(f'masking.dictionaries.{name} must be a list of values')
+
+            options.mask_dictionaries[name] = values
+
+        tables = request.get('tables') or {}
+        if not isinstance(tables, dict):
+            raise ValueError('tables must be an object')
+
+        for table_name, table_config in tables.items():
+            if not isinstance(table_config, dict):
+                raise ValueError(f'tables.{table_name} must be an object')
+
+            for name in table_config.keys():
+                if name not in table_options.keys():
+                    raise ValueError(f'option not accepted: tables.{table_name}.{name}')
+
+            options.parse_table_config(table_name, {
+                name: table_options[name](f'tables.{table_name}.{name}', value)
+                for name, value in table_config.items()})
+
+        return options
+
+    def slice(self, request: Dict[str, Any], handler: 'SliceRequestHandler') -> None:
+        options = self.get_options(request)
+        connection = self.connections.get()
+
+        try:
+            if connection.closed:
+                connection = self.open_connection()
+
+            cursor = connection.cursor()
+            schema = self.refresh_schema(cursor)
+            output = self.open_output(options, handler)
+            data_generator = DataGenerator(cursor, schema, options, output)
+
+            if isinstance(output, StreamOutput):
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'application/sql; charset=utf-8')
+                handler.send_header('Transfer-Encoding', 'chunked')
+                handler.end_headers()
+                handler.streaming = True
+
+            output.write_pre_data(schema.schema)
+            data_generator.generate_data()
+
+            post_data = []
+            if options.split_sections:
+                post_data = schema.post_data + schema.generate_sequence_values()
+
+            output.write_post_data('\n'.join(post_data), post_data)
+            output.close()
+
+            if isinstance(output, StreamOutput):
+                output.stream.detach().detach()
+                handler.response.finish()
+            else:
+                handler.send_json(200, {'tables': data_generator.row_counts})
+        finally:
+            if handler.response:
+                handler.response.aborted = True
+
+            self.release_connection(connection)
+
+    def release_connection(self, connection: _connection) -> None:
+        try:
+            cursor = connection.cursor()
+            cursor.execute('DISCARD TEMP')
+            cursor.close()
+        except psycopg2.Error:
+            connection.close()
+
+        self.connections.put(connection)
+
+    @staticmethod
+    def open_output(options: Options, handler: 'SliceRequestHandler') \
+            -> Union[StreamOutput, DirectoryOutput, TargetOutput]:
+        if options.target_dsn:
+            return TargetOutput(options.target_dsn, options.jobs)
+
+        if options.output_dir:
+            return DirectoryOutput(options.output_dir, options.compress)
+
+        handler.response = ChunkedResponse(handler.wfile)
+
+        return StreamOutput(io.TextIOWrapper(io.BufferedWriter(handler.response), encoding='utf-8'))
+
+
+class SliceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], handler: type, service: SliceService):
+        super().__init__(address, handler)
+        self.service = service
+
+
+class SliceRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: SliceServer
+    streaming = False
+    response = None
+
+    def send_json(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path != '/status':
+            self.send_json(404, {'error': f'unknown path {self.path}'})
+
+            return
+
+        self.send_json(200, {'tables': len(self.server.service.schema.tables),
+                             'idle_connections': self.server.service.connections.qsize()})
+
+    def do_POST(self) -> None:
+        if self.path != '/slice':
+            self.send_json(404, {'error': f'unknown path {self.path}'})
+
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError('the request body must be a JSON object')
+        except ValueError as error:
+            self.send_json(400, {'error': str(error)})
+
+            return
+
+        try:
+            self.server.service.slice(request, self)
+        except ValueError as error:
+            self.send_error_json(400, error)
+        except Exception as error:
+            self.send_error_json(500, error)
+        finally:
+            self.streaming = False
+            self.response = None
+
+    def send_error_json(self, status: int, error: Exception) -> None:
+        if not self.streaming:
+            self.send_json(status, {'error': str(error)})
+
+            return
+
+        self.log_error('slice aborted: %s', error)
+        self.close_connection = True
@@ -0,0 +1,84 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Union
+
+from psycopg2.extensions import connection as _connection
+
+from data_generator import DataGenerator
+from key_store import KeyStore
+from options import Options
+from output import DirectoryOutput, StreamOutput, TargetOutput
+from schema_generator import SchemaGenerator
+from stats import Stats
+from worker_pool import WorkerPool
+
+
+class Shard:
+    def __init__(self, dsn: str, limit: int = None):
+        if not dsn:
+            raise ValueError('a shard requires a dsn')
+
+        self.dsn = dsn
+        self.limit = limit
+
+    @classmethod
+    def parse(cls, spec: Union[str, Dict[str, Any]]) -> 'Shard':
+        if isinstance(spec, dict):
+            return cls(spec.get('dsn'), spec.get('limit'))
+
+        return cls(str(spec))
+
+    def get_options(self, options: Options) -> Options:
+        shard_options = copy.copy(options)
+        if self.limit:
+            shard_options.limit = self.limit
+
+        return shard_options
+
+
+class ShardSet:
+    shards: List[Shard]
+    shared_rows: KeyStore
+
+    def __init__(self, dsn: str, options: Options, connect: Callable[[str], _connection]):
+        self.shards = [Shard(dsn)] + [Shard.parse(spec) for spec in options.shards]
+        self.options = options
+        self.connect = connect
+        self.shared_rows = KeyStore(options.key_memory_budget * 1024 * 1024)
+
+    def generate_data(self,
+                      schema: SchemaGenerator,
+                      output: Union[StreamOutput, DirectoryOutput, TargetOutput],
+                      stats: Stats) -> None:
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.shards),
+                                    thread_name_prefix='pg-slicer-shard') as executor:
+                futures = [executor.submit(self.extract_shard, shard, schema, output, stats)
+                           for shard in self.shards]
+
+                for future in futures:
+                    future.result()
+        finally:
+            self.shared_rows.close()
+
+    def extract_shard(self,
+                      shard: Shard,
+                      schema: SchemaGenerator,
+                      output: Union[StreamOutput, DirectoryOutput, TargetOutput],
+                      stats: Stats) -> None:
+        connection = self.connect(shard.dsn)
+        connection.autocommit = True
+
+        pool = None
+        if self.options.jobs > 1:
+            pool = WorkerPool(connection, shard.dsn, self.options.jobs, self.connect)
+            pool.start()
+
+        try:
+            DataGenerator(connection.cursor(), schema, shard.get_options(self.options), output,
+                          pool, stats, shared_rows=self.shared_rows).generate_data()
+        finally:
+            if pool:
+                pool.close()
+
+            connection.close()
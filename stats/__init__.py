@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+from psycopg2.extensions import cursor as _cursor
+
+PHASES = ['introspection', 'condition', 'query', 'fetch', 'encode', 'write']
+SCHEMA = '(schema)'
+
+
+class PhaseStats:
+    def __init__(self):
+        self.seconds = 0.0
+        self.queries = 0
+        self.counters: Dict[str, int] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(seconds=round(self.seconds, 6), queries=self.queries, **self.counters)
+
+
+class StatsCursor:
+    def __init__(self, stats: 'Stats', cursor: _cursor):
+        self.stats = stats
+        self.cursor = cursor
+
+    def execute(self, query, vars=None):
+        self.stats.add(self.stats.get_current()[0], self.stats.get_current()[1], queries=1)
+
+        return self.cursor.execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        self.stats.add(self.stats.get_current()[0], self.stats.get_current()[1], queries=1)
+
+        return self.cursor.copy_expert(sql, file, size)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name: str):
+        return getattr(self.cursor, name)
+
+
+class Stats:
+    tables: Dict[str, Dict[str, PhaseStats]]
+    events: List[Dict[str, Any]]
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.tables = {}
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.perf_counter()
+
+    def get_current(self) -> tuple:
+        stack = getattr(self.local, 'stack', None)
+
+        return stack[-1] if stack else (SCHEMA, 'introspection')
+
+    def wrap_cursor(self, cursor: _cursor):
+        return StatsCursor(self, cursor) if self.enabled else cursor
+
+    def get_phase(self, table_name: str, phase: str) -> PhaseStats:
+        return self.tables.setdefault(table_name, {}).setdefault(phase, PhaseStats())
+
+    def add(self, table_name: str, phase: str, seconds: float = 0.0, queries: int = 0,
+            **counters: int) -> None:
+        if not self.enabled:
+            return
+
+        with self.lock:
+            phase_stats = self.get_phase(table_name, phase)
+            phase_stats.seconds += seconds
+            phase_stats.queries += queries
+            for name, value in counters.items():
+                phase_stats.counters[name] = phase_stats.counters.get(name, 0) + value
+
+    @contextmanager
+    def phase(self, table_name: Optional[str], phase: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+
+            return
+
+        table_name = table_name or SCHEMA
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+
+        self.local.stack.append((table_name, phase))
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            finished = time.perf_counter()
+            self.local.stack.pop()
+            self.add(table_name, phase, finished - started)
+
+            with self.lock:
+                self.events.append({
+                    'name': f'{table_name} {phase}',
+                    'cat': phase,
+                    'ph': 'X',
+                    'ts': round((started - self.started) * 1000000),
+                    'dur': round((finished - started) * 1000000),
+                    'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                    'args': {'table': table_name},
+                })
+
+    def get_totals(self) -> Dict[str, Dict[str, Any]]:
+        totals = {}
+
+        for phases in self.tables.values():
+            for phase, phase_stats in phases.items():
+                total = totals.setdefault(phase, PhaseStats())
+                total.seconds += phase_stats.seconds
+                total.queries += phase_stats.queries
+                for name, value in phase_stats.counters.items():
+                    total.counters[name] = total.counters.get(name, 0) + value
+
+        return {phase: total.to_dict() for phase, total in totals.items()}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'elapsed': round(time.perf_counter() - self.started, 6),
+            'totals': self.get_totals(),
+            'tables': {table_name: {phase: phase_stats.to_dict()
+                                    for phase, phase_stats in phases.items()}
+                       for table_name, phases in self.tables.items()},
+            'traceEvents': self.events,
+            'displayTimeUnit': 'ms',
+        }
+
+    def write_json(self, path: str) -> None:
+        with open(path, 'w') as stats_file:
+            json.dump(self.to_dict(), stats_file, indent=2)
+
+    def get_counter(self, table_name: str, name: str) -> int:
+        return sum([phase_stats.counters.get(name, 0)
+                    for phase_stats in self.tables.get(table_name, {}).values()])
+
+    def write_summary(self, stream: TextIO) -> None:
+        rows = []
+        for table_name, phases in self.tables.items():
+            seconds = [phases[phase].seconds if phase in phases else 0.0 for phase in PHASES]
+            queries = sum([phase_stats.queries for phase_stats in phases.values()])
+            rows.append((sum(seconds), table_name, seconds, queries,
+                         self.get_counter(table_name, 'rows_fetched'),
+                         self.get_counter(table_name, 'rows_kept'),
+                         self.get_counter(table_name, 'where_bytes'),
+                         self.get_counter(table_name, 'bytes_written')))
+
+        header = ['total'] + PHASES + ['queries', 'fetched', 'kept', 'where', 'bytes']
+        width = max([len('table')] + [len(row[1]) for row in rows])
+        stream.write('table'.ljust(width) + ' '
+                     + ' '.join([f'{column:>13}' for column in header]) + '\n')
+
+        for total, table_name, seconds, *counters in sorted(rows, reverse=True):
+            columns = [f'{total:.3f}'] + [f'{value:.3f}' for value in seconds] \
+                      + [str(value) for value in counters]
+            stream.write(table_name.ljust(width) + ' '
+                         + ' '.join([f'{column:>13}' for column in columns]) + '\n')
+
+        stream.write(f'elapsed {time.perf_counter() - self.started:.3f}s\n')
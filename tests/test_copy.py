@@ -0,0 +1,157 @@
+import io
+import struct
+import unittest
+import uuid
+from typing import List, Optional
+
+from data_generator import BinaryCopyWriter, CopyWriter, decode_copy_value, encode_copy_value, \
+    get_binary_decoder
+from key_store import KeySet, KeyStore
+from output import BINARY_HEADER, BINARY_TRAILER
+from schema_generator import Column, Table
+
+
+def make_table() -> Table:
+    return Table('users', [Column('id', 'integer', None, True, 1, None),
+                           Column('name', 'text', None, False, 2, None),
+                           Column('token', 'uuid', None, False, 3, None)])
+
+
+def pack_tuple(fields: List[Optional[bytes]]) -> bytes:
+    return struct.pack('!h', len(fields)) + b''.join(
+        [struct.pack('!i', -1) if field is None else struct.pack('!i', len(field)) + field
+         for field in fields])
+
+
+def write_in_chunks(writer: io.IOBase, data, size: int) -> None:
+    for start in range(0, len(data), size):
+        writer.write(data[start:start + size])
+
+
+class CopyTextTest(unittest.TestCase):
+    def test_round_trip(self) -> None:
+        values = ['plain', 'back\\slash', 'tab\there', 'carriage\rreturn', '\\N', '',
+                  'trailing\\', 'mixed\\t\t\\n']
+
+        for value in values:
+            encoded = encode_copy_value(value)
+
+            self.assertNotIn('\t', encoded)
+            self.assertNotIn('\n', encoded)
+            self.assertNotIn('\r', encoded)
+            self.assertEqual(decode_copy_value(encoded), value)
+
+    def test_null_and_scalars(self) -> None:
+        self.assertEqual(encode_copy_value(None), '\\N')
+        self.assertIsNone(decode_copy_value('\\N'))
+        self.assertEqual(encode_copy_value(True), 't')
+        self.assertEqual(encode_copy_value(42), '42')
+        self.assertEqual(encode_copy_value({'k': 'v'}), '{"k": "v"}')
+
+    def test_line_breaks_are_normalized(self) -> None:
+        self.assertEqual(encode_copy_value('a\nb'), 'a\\r\\nb')
+        self.assertEqual(encode_copy_value('a\r\nb'), 'a\\r\\nb')
+        self.assertEqual(decode_copy_value('a\\r\\nb'), 'a\r\nb')
+
+    def test_server_escapes(self) -> None:
+        self.assertEqual(decode_copy_value('\\b\\f\\v'), '\b\f\v')
+        self.assertEqual(decode_copy_value('\\x41\\101\\7'), 'AA\x07')
+        self.assertEqual(decode_copy_value('\\q'), 'q')
+
+    def test_writer_collects_keys_and_drops_trailing_columns(self) -> None:
+        key_store = KeyStore(1024 * 1024)
+        keys = {1: key_store.create('users', 1, 'integer'),
+                2: key_store.create('users', 2, 'text')}
+        output = io.StringIO()
+        writer = CopyWriter(make_table(), {1: 0, 2: 1}, keys, key_store, output, trailing=1)
+        data = '1\ta\\tb\t\\N\textra\n2\t\\N\t\\N\textra\n'
+
+        write_in_chunks(writer, data, 3)
+        writer.close()
+
+        self.assertEqual(output.getvalue(),
+                         'COPY users FROM stdin;\n1\ta\\tb\t\\N\n2\t\\N\t\\N\n\\.\n\n')
+        self.assertEqual(sorted(keys[1]), [1, 2])
+        self.assertEqual(list(keys[2]), ['a\tb'])
+        self.assertTrue(keys[1].sealed)
+        self.assertEqual(writer.rows, 2)
+
+    def test_writer_skips_seen_rows(self) -> None:
+        key_store = KeyStore(1024 * 1024)
+        output = io.StringIO()
+        seen = KeySet('users', 0, 'text')
+        writer = CopyWriter(make_table(), {}, {}, key_store, output, framed=False, seen=seen,
+                            identity=[0])
+
+        writer.write('1\ta\t\\N\n2\tb\t\\N\n1\tc\t\\N\n')
+        writer.write_rows([(2, 'd', None), (3, 'e', None)])
+        writer.close()
+
+        self.assertEqual(output.getvalue(), '1\ta\t\\N\n2\tb\t\\N\n3\te\t\\N\n')
+        self.assertEqual(writer.fetched, 5)
+        self.assertEqual(writer.rows, 3)
+
+
+class CopyBinaryTest(unittest.TestCase):
+    def test_decoders(self) -> None:
+        token = uuid.uuid4()
+
+        self.assertEqual(get_binary_decoder('smallint')(struct.pack('!h', -2)), -2)
+        self.assertEqual(get_binary_decoder('integer')(struct.pack('!i', 7)), 7)
+        self.assertEqual(get_binary_decoder('bigint')(struct.pack('!q', 2 ** 40)), 2 ** 40)
+        self.assertEqual(get_binary_decoder('boolean')(b'\x01'), 't')
+        self.assertEqual(get_binary_decoder('character varying(20)')('é'.encode()), 'é')
+        self.assertEqual(get_binary_decoder('uuid')(token.bytes), str(token))
+        self.assertIsNone(get_binary_decoder('jsonb'))
+
+    def test_tuples_round_trip_in_any_chunking(self) -> None:
+        token = uuid.uuid4()
+        tuples = [[struct.pack('!i', 1), b'first', token.bytes, b'x'],
+                  [struct.pack('!i', 2), None, None, b'y'],
+                  [struct.pack('!i', 3), b'', token.bytes, None]]
+        data = BINARY_HEADER + b''.join([pack_tuple(fields) for fields in tuples]) \
+            + BINARY_TRAILER
+        expected = b''.join([pack_tuple(fields[:3]) for fields in tuples])
+
+        for size in [1, 2, 5, 19, 64, len(data)]:
+            key_store = KeyStore(1024 * 1024)
+            keys = {1: key_store.create('users', 1, 'integer'),
+                    3: key_store.create('users', 3, 'uuid')}
+            output = io.BytesIO()
+            writer = BinaryCopyWriter(make_table(), {1: 0, 3: 2}, keys, key_store, output,
+                                      trailing=1)
+
+            write_in_chunks(writer, data, size)
+            writer.close()
+
+            self.assertEqual(output.getvalue(), expected)
+            self.assertEqual(sorted(keys[1]), [1, 2, 3])
+            self.assertEqual(list(keys[3]), [str(token)])
+            self.assertEqual(writer.rows, 3)
+
+    def test_header_extension_is_skipped(self) -> None:
+        header = BINARY_HEADER[:15] + struct.pack('!i', 4) + b'ext!'
+        row = pack_tuple([struct.pack('!i', 5)])
+        output = io.BytesIO()
+        writer = BinaryCopyWriter(make_table(), {}, {}, KeyStore(0), output)
+
+        write_in_chunks(writer, header + row + BINARY_TRAILER, 3)
+        writer.close()
+
+        self.assertEqual(output.getvalue(), row)
+
+    def test_seen_rows_are_skipped(self) -> None:
+        rows = [pack_tuple([struct.pack('!i', value), b'v']) for value in [1, 2, 1]]
+        output = io.BytesIO()
+        writer = BinaryCopyWriter(make_table(), {}, {}, KeyStore(0), output, seen={},
+                                  identity=[0])
+
+        writer.write(BINARY_HEADER + b''.join(rows) + BINARY_TRAILER)
+        writer.close()
+
+        self.assertEqual(output.getvalue(), rows[0] + rows[1])
+        self.assertEqual(writer.fetched, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
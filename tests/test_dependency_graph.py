@@ -0,0 +1,91 @@
+import unittest
+from typing import List, Tuple
+
+from dependency_graph import DependencyGraph
+from schema_generator import Column, Relation, Table
+
+
+def make_table(name: str, parents: List[Tuple[str, bool]] = None) -> Table:
+    columns = [Column('id', 'integer', None, True, 1, None)]
+    relations = []
+
+    for position, (parent, not_null) in enumerate(parents or [], 2):
+        columns.append(Column(f'{parent}_id', 'integer', None, not_null, position, None))
+        relations.append(Relation(parent, f'{name}_{parent}_fkey', '', 'parent', position, 1))
+
+    return Table(name, columns, [], relations)
+
+
+class DependencyGraphTest(unittest.TestCase):
+    def test_chain_is_layered_by_depth(self) -> None:
+        graph = DependencyGraph([make_table('comments', [('posts', True)]),
+                                 make_table('posts', [('users', True)]),
+                                 make_table('users')])
+
+        self.assertEqual(graph.get_layers(), [[['users']], [['posts']], [['comments']]])
+
+    def test_siblings_share_a_layer_in_table_order(self) -> None:
+        graph = DependencyGraph([make_table('posts', [('users', True)]),
+                                 make_table('users'),
+                                 make_table('orgs'),
+                                 make_table('members', [('orgs', True), ('users', True)])])
+
+        self.assertEqual(graph.get_layers(),
+                         [[['users'], ['orgs']], [['posts'], ['members']]])
+
+    def test_cycle_is_one_component(self) -> None:
+        graph = DependencyGraph([make_table('a', [('b', True)]),
+                                 make_table('b', [('a', True)]),
+                                 make_table('c', [('a', True)]),
+                                 make_table('d')])
+
+        components = sorted([sorted(component) for component in graph.get_components()])
+
+        self.assertEqual(components, [['a', 'b'], ['c'], ['d']])
+        self.assertTrue(graph.is_cyclic(['a', 'b']))
+        self.assertFalse(graph.is_cyclic(['c']))
+        self.assertEqual(graph.get_layers(), [[['a', 'b'], ['d']], [['c']]])
+
+    def test_self_reference_is_cyclic(self) -> None:
+        graph = DependencyGraph([make_table('nodes', [('nodes', True)]),
+                                 make_table('leaves', [('nodes', True)])])
+
+        self.assertTrue(graph.is_cyclic(['nodes']))
+        self.assertFalse(graph.is_cyclic(['leaves']))
+        self.assertEqual(graph.get_layers(), [[['nodes']], [['leaves']]])
+
+    def test_nested_cycles_follow_their_parents(self) -> None:
+        graph = DependencyGraph([make_table('a', [('b', True)]),
+                                 make_table('b', [('c', True)]),
+                                 make_table('c', [('a', True)]),
+                                 make_table('d', [('e', True), ('c', True)]),
+                                 make_table('e', [('d', True)])])
+
+        self.assertEqual(graph.get_layers(), [[['a', 'b', 'c']], [['d', 'e']]])
+
+    def test_required_only_ignores_nullable_references(self) -> None:
+        tables = [make_table('a', [('b', False)]),
+                  make_table('b', [('a', True)])]
+
+        self.assertEqual(DependencyGraph(tables).get_layers(), [[['a', 'b']]])
+        self.assertEqual(DependencyGraph(tables, required_only=True).get_layers(),
+                         [[['a']], [['b']]])
+
+    def test_unknown_parents_are_ignored(self) -> None:
+        graph = DependencyGraph([make_table('posts', [('users', True)])])
+
+        self.assertEqual(graph.parents, {'posts': []})
+        self.assertEqual(graph.get_layers(), [[['posts']]])
+
+    def test_deep_chain_does_not_recurse(self) -> None:
+        tables = [make_table('t0')] + [make_table(f't{index}', [(f't{index - 1}', True)])
+                                       for index in range(1, 5000)]
+
+        layers = DependencyGraph(list(reversed(tables))).get_layers()
+
+        self.assertEqual(len(layers), 5000)
+        self.assertEqual(layers[-1], [['t4999']])
+
+
+if __name__ == '__main__':
+    unittest.main()
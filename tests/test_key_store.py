@@ -0,0 +1,126 @@
+import os
+import tempfile
+import unittest
+
+from key_store import IntStorage, KeySet, KeyStore
+
+
+class IntStorageTest(unittest.TestCase):
+    def test_add_and_contains(self) -> None:
+        storage = IntStorage()
+        values = list(range(-5000, 5000, 7)) + [2 ** 62, -2 ** 62]
+
+        for value in values:
+            self.assertTrue(storage.add(value))
+
+        for value in values:
+            self.assertFalse(storage.add(value))
+            self.assertIn(value, storage)
+
+        self.assertNotIn(1, storage)
+        self.assertEqual(len(storage), len(values))
+        self.assertEqual(sorted(storage), sorted(values))
+
+    def test_empty_marker_is_a_value(self) -> None:
+        storage = IntStorage()
+
+        self.assertNotIn(IntStorage.EMPTY, storage)
+        self.assertTrue(storage.add(IntStorage.EMPTY))
+        self.assertFalse(storage.add(IntStorage.EMPTY))
+        self.assertIn(IntStorage.EMPTY, storage)
+        self.assertEqual(list(storage), [IntStorage.EMPTY])
+        self.assertEqual(len(storage), 1)
+
+
+class KeySetTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_int_keys_across_spill(self) -> None:
+        key_set = KeySet('users', 1, 'integer')
+        self.assertTrue(key_set.add(1))
+        self.assertTrue(key_set.add('2'))
+        self.assertFalse(key_set.add('1'))
+
+        key_set.spill(os.path.join(self.directory.name, 'keys.sqlite'))
+
+        self.assertTrue(key_set.spilled)
+        self.assertEqual(key_set.nbytes(), 0)
+        self.assertIn(1, key_set)
+        self.assertIn('2', key_set)
+        self.assertNotIn(3, key_set)
+        self.assertFalse(key_set.add(2))
+        self.assertTrue(key_set.add(3))
+        self.assertEqual(len(key_set), 3)
+        self.assertEqual(sorted(key_set), [1, 2, 3])
+        self.assertEqual(key_set.to_sql().split(','), [str(value) for value in key_set])
+
+        key_set.close()
+
+    def test_text_keys_across_spill(self) -> None:
+        key_set = KeySet('posts', 2, 'uuid')
+        values = ['a', 'b\tc', "d'e"]
+        for value in values:
+            key_set.add(value)
+
+        key_set.spill(os.path.join(self.directory.name, 'keys.sqlite'))
+
+        for value in values:
+            self.assertIn(value, key_set)
+            self.assertFalse(key_set.add(value))
+
+        self.assertTrue(key_set.add('f'))
+        self.assertEqual(sorted(key_set), sorted(values + ['f']))
+        self.assertIn("'d''e'", key_set.to_sql())
+
+        key_set.close()
+
+
+class KeyStoreTest(unittest.TestCase):
+    def test_budget_spills_sealed_and_own_key_sets(self) -> None:
+        key_store = KeyStore(0)
+        sealed = key_store.create('users', 1, 'integer')
+        open_set = key_store.create('posts', 1, 'integer')
+        own = key_store.create('comments', 1, 'integer')
+
+        for key_set in [sealed, open_set, own]:
+            key_set.add(1)
+
+        sealed.sealed = True
+        key_store.enforce_budget()
+
+        self.assertTrue(sealed.spilled)
+        self.assertFalse(open_set.spilled)
+        self.assertFalse(own.spilled)
+
+        key_store.enforce_budget([own])
+
+        self.assertTrue(own.spilled)
+        self.assertFalse(open_set.spilled)
+        self.assertIn(1, own)
+        self.assertIs(key_store.create('users', 1, 'integer'), sealed)
+
+        directory = key_store.directory
+        key_store.close()
+
+        self.assertFalse(os.path.exists(directory))
+
+    def test_budget_is_not_enforced_below_limit(self) -> None:
+        key_store = KeyStore(1024 * 1024)
+        key_set = key_store.create('users', 1, 'text')
+        key_set.add('a')
+        key_set.sealed = True
+
+        key_store.enforce_budget()
+
+        self.assertFalse(key_set.spilled)
+        self.assertIsNone(key_store.directory)
+
+        key_store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
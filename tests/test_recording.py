@@ -0,0 +1,162 @@
+import datetime
+import decimal
+import io
+import json
+import os
+import tempfile
+import unittest
+from typing import Any, List
+
+from psycopg2.extras import DateTimeTZRange, NumericRange
+
+from recording import Player, Recorder, RecordingConnection, decode_rows, decode_value, \
+    encode_rows, encode_value, get_query_key
+
+
+class FakeCursor:
+    def __init__(self, results: List[List[tuple]]):
+        self.results = results
+        self.rows = []
+        self.description = None
+
+    def execute(self, query: str, vars: Any = None) -> None:
+        self.rows = self.results.pop(0)
+        self.description = [('column',)]
+
+    def fetchall(self) -> List[tuple]:
+        return self.rows
+
+    def fetchmany(self, size: int) -> List[tuple]:
+        rows, self.rows = self.rows[:size], self.rows[size:]
+
+        return rows
+
+    def copy_expert(self, sql: str, file: io.IOBase, size: int = 8192) -> None:
+        file.write('1\tone\n2\t')
+        file.write('two\n')
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+    def __init__(self, results: List[List[tuple]]):
+        self.results = results
+        self.autocommit = True
+
+    def cursor(self, name: str = None, withhold: bool = False) -> FakeCursor:
+        return FakeCursor(self.results)
+
+
+class RecordingValuesTest(unittest.TestCase):
+    def test_values_round_trip_through_json(self) -> None:
+        values = [None, True, 3, 2.5, 'text', b'\x00\xff', [1, [2, None]], {'k': ['v']},
+                  decimal.Decimal('1.10'), datetime.date(2020, 2, 29),
+                  datetime.datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc),
+                  datetime.time(23, 59, 1), datetime.timedelta(days=-1, seconds=5),
+                  NumericRange(1, 10, '[)'), NumericRange(empty=True),
+                  DateTimeTZRange(datetime.datetime(2020, 1, 1), None, '[)')]
+
+        rows = decode_rows(json.loads(json.dumps(encode_rows([tuple(values)]))))
+
+        self.assertEqual(rows, [tuple(values)])
+        self.assertEqual(type(rows[0][8]), decimal.Decimal)
+        self.assertIsNone(decode_rows(encode_rows(None)))
+
+    def test_json_objects_are_not_decoded_as_tags(self) -> None:
+        value = {'$': 'bytes', 'v': 'AA=='}
+
+        self.assertEqual(decode_value(json.loads(json.dumps(encode_value(value)))), value)
+
+    def test_unknown_tags_are_rejected(self) -> None:
+        with self.assertRaises(ValueError):
+            decode_value({'$': 'pickle', 'v': ''})
+
+    def test_query_keys_ignore_literals(self) -> None:
+        self.assertEqual(get_query_key("SELECT *  FROM t WHERE id IN (1, 2,3) AND s = 'a''b'"),
+                         'SELECT * FROM t WHERE id IN (?) AND s = ?')
+
+
+class RecordAndReplayTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'slice.rec.gz')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def record(self, values: str) -> List[Any]:
+        recorder = Recorder(self.path, values)
+        connection = RecordingConnection(FakeConnection([
+            [('users', 1)],
+            [('2020-01-01 10:00:00+00',)],
+            [(1, 'alice'), (2, 'bob'), (3, 'carol')],
+        ]), recorder)
+        results = []
+
+        cursor = connection.cursor()
+        cursor.execute('SELECT c.relname, 1 FROM pg_catalog.pg_class c')
+        results.append(cursor.fetchall())
+        cursor.execute('SELECT max(updated_at)::text FROM users')
+        results.append(cursor.fetchall())
+
+        named_cursor = connection.cursor('pg_slicer_1')
+        named_cursor.execute('SELECT id, name FROM users WHERE id IN (1, 2, 3)')
+        results.append(named_cursor.fetchmany(2) + named_cursor.fetchmany(2))
+
+        stream = io.StringIO()
+        cursor.copy_expert('COPY (SELECT id, name FROM users) TO STDOUT', stream)
+        results.append(stream.getvalue())
+
+        recorder.close()
+
+        return results
+
+    def replay(self) -> List[Any]:
+        connection = Player(self.path).connect('')
+        results = []
+
+        cursor = connection.cursor()
+        cursor.execute('SELECT c.relname, 1 FROM pg_catalog.pg_class c')
+        results.append(cursor.fetchall())
+        cursor.execute('SELECT max(updated_at)::text FROM users')
+        results.append(cursor.fetchall())
+
+        named_cursor = connection.cursor('pg_slicer_1')
+        named_cursor.execute('SELECT id, name FROM users WHERE id IN (4, 5)')
+        results.append(named_cursor.fetchmany(2) + named_cursor.fetchmany(2))
+
+        stream = io.StringIO()
+        cursor.copy_expert('COPY (SELECT id, name FROM users) TO STDOUT', stream)
+        results.append(stream.getvalue())
+
+        return results
+
+    def test_full_recording_replays_the_same_results(self) -> None:
+        recorded = self.record('full')
+
+        self.assertEqual(self.replay(), recorded)
+
+    def test_masked_recording_scrambles_table_data_only(self) -> None:
+        recorded = self.record('masked')
+        replayed = self.replay()
+
+        self.assertEqual(recorded[2], [(1, 'alice'), (2, 'bob'), (3, 'carol')])
+        self.assertEqual(replayed[0], [('users', 1)])
+        self.assertNotEqual(replayed[1], recorded[1])
+        self.assertEqual(len(replayed[1][0][0]), len(recorded[1][0][0]))
+        self.assertNotEqual(replayed[2], recorded[2])
+        self.assertEqual([len(row[1]) for row in replayed[2]], [5, 3, 5])
+        self.assertNotEqual(replayed[3], recorded[3])
+        self.assertEqual(replayed[3].count('\n'), 2)
+
+    def test_other_files_are_rejected(self) -> None:
+        with open(self.path, 'wb') as file:
+            file.write(b'not a recording')
+
+        with self.assertRaises(ValueError):
+            Player(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import itertools
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, Optional
+
+import psycopg2
+from psycopg2.extensions import connection as _connection, cursor as _cursor, \
+    ISOLATION_LEVEL_REPEATABLE_READ
+
+
+class WorkerPool:
+    connection: _connection
+    connections: List[_connection]
+    snapshot: Optional[str]
+
+    def __init__(self,
+                 connection: _connection,
+                 dsn: str,
+                 jobs: int,
+                 connect: Callable[[str], _connection] = psycopg2.connect):
+        self.connection = connection
+        self.dsn = dsn
+        self.jobs = jobs
+        self.connect = connect
+        self.connections = []
+        self.idle = queue.Queue()
+        self.executor = None
+        self.snapshot = None
+
+    def start(self) -> None:
+        self.connection.autocommit = False
+        self.connection.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ)
+
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT pg_catalog.pg_export_snapshot()')
+        self.snapshot = cursor.fetchone()[0]
+        cursor.close()
+
+        self.idle.put(self.connection)
+
+        for _ in range(self.jobs - 1):
+            connection = self.connect(self.dsn)
+            connection.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ)
+            cursor = connection.cursor()
+            cursor.execute('SET TRANSACTION SNAPSHOT %s', (self.snapshot,))
+            cursor.close()
+
+            self.connections.append(connection)
+            self.idle.put(connection)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='pg-slicer')
+
+    def run(self, task: Callable[[Any, _cursor], Any], item: Any) -> Any:
+        connection = self.idle.get()
+
+        try:
+            cursor = connection.cursor()
+            result = task(item, cursor)
+            cursor.close()
+        finally:
+            self.idle.put(connection)
+
+        return result
+
+    def map(self, task: Callable[[Any, _cursor], Any], items: List[Any]) -> Iterator[Any]:
+        pending = iter(items)
+        futures = deque([self.executor.submit(self.run, task, item)
+                         for item in itertools.islice(pending, self.jobs)])
+
+        try:
+            while futures:
+                result = futures.popleft().result()
+                for item in itertools.islice(pending, 1):
+                    futures.append(self.executor.submit(self.run, task, item))
+
+                yield result
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self) -> None:
+        if self.executor:
+            self.executor.shutdown(wait=True)
+
+        for connection in self.connections:
+            connection.rollback()
+            connection.close()
+
+        if not self.connection.closed:
+            self.connection.rollback()
+            self.connection.autocommit = True